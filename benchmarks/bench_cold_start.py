@@ -0,0 +1,66 @@
+# Benchmark: cold-start cost of scrape.py, measured in fresh interpreters.
+# "import" is `import scrape`; "first use" adds building the DynamoDB table and HTTP session and
+# rendering one embed, which every invocation does before its first network call.
+# Prints the -X importtime breakdown of the slowest imports as well.
+# Before lazy loading (eager boto3 resource and shapely): import 480 ms, first use 530 ms.
+# Target: import under 150 ms and first use at least 35% faster, by never loading shapely
+# without regions and building the DynamoDB resource only when it is used.
+# Run from the repository root (config.json must exist): python benchmarks/bench_cold_start.py
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 7
+
+ENV = dict(os.environ, DISCORD_WEBHOOK='https://mock-discord-webhook.com/bench', AWS_DEFAULT_REGION='us-east-1')
+
+IMPORT = "import time; t = time.perf_counter(); import scrape; print(time.perf_counter() - t)"
+FIRST_USE = (
+    "import time; t = time.perf_counter(); import scrape; from closurebot import store, runtime; store.table.name; runtime.http_session.adapters; "
+    "scrape.render_embed('closure', {'ID': 1, 'RoadwayName': 'Route 1', 'DirectionOfTravel': 'Both', "
+    "'Description': 'Closed', 'StartDate': 1700000000, 'Latitude': 45.9, 'Longitude': -66.6}); "
+    "print(time.perf_counter() - t)"
+)
+
+
+def timed(code):
+    samples = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=ENV, capture_output=True, text=True, check=True)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples) * 1000
+
+
+def import_breakdown(top=12):
+    # (cumulative us, module) for the slowest imports of scrape and its closurebot modules
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import scrape'], cwd=ROOT, env=ENV,
+                            capture_output=True, text=True, check=True)
+    entries = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((len(name) - len(name.lstrip()), int(cumulative), name.strip()))
+    # Children are listed before the module that imported them, so a module's parent is the
+    # next entry one level up. Only imports made by scrape and the closurebot modules are kept.
+    rows = []
+    for index, (depth, cumulative, name) in enumerate(entries):
+        parent = next((later[2] for later in entries[index + 1:] if later[0] < depth), None)
+        if parent == 'scrape' or (parent or '').startswith('closurebot'):
+            rows.append((cumulative, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    print(f"median of {RUNS} fresh interpreters")
+    print(f"  import scrape        {timed(IMPORT):7.1f} ms")
+    print(f"  import + first use   {timed(FIRST_USE):7.1f} ms")
+    print("slowest imports made by scrape and closurebot (-X importtime, cumulative):")
+    for cumulative, name in import_breakdown():
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
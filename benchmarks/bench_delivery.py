@@ -0,0 +1,56 @@
+# Benchmark: delivering a storm's worth of Discord notifications serially vs through DeliveryPool.
+# Uses the local stub webhook from tests/stub_webhook.py with per-request latency and a rate limit.
+# Run from the repository root (config.json must exist): python benchmarks/bench_delivery.py
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import scrape
+from tests.stub_webhook import StubWebhookServer
+
+MESSAGES = 30
+LATENCY = 0.15       # seconds per webhook call, roughly a Discord round trip from us-east-1
+RATE_LIMIT = 5       # Discord's usual webhook bucket: 5 requests per 2 seconds
+RATE_WINDOW = 2.0
+WORKERS = [1, 4, 8]
+
+EVENT = {
+    'ID': 0, 'EventType': 'closures', 'RoadwayName': 'Route 1', 'DirectionOfTravel': 'Both Directions',
+    'Description': 'Flooding, road closed.', 'StartDate': 1735406520, 'PlannedEndDate': None,
+    'Latitude': 45.27, 'Longitude': -66.06,
+}
+
+
+def run(workers, rate_limit):
+    with StubWebhookServer(latency=LATENCY, rate_limit=rate_limit, rate_window=RATE_WINDOW) as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url):
+        start = time.perf_counter()
+        if workers == 1:
+            for i in range(MESSAGES):
+                scrape.post_to_discord_closure(dict(EVENT, ID=i))
+        else:
+            with scrape.DeliveryPool(workers):
+                for i in range(MESSAGES):
+                    scrape.post_to_discord_closure(dict(EVENT, ID=i))
+        elapsed = time.perf_counter() - start
+    assert len(stub.requests) == MESSAGES
+    return elapsed, stub.rate_limited
+
+
+def main():
+    print(f"{MESSAGES} messages, {LATENCY * 1000:.0f} ms per call")
+    print(f"{'rate limit':>14} {'workers':>8} {'seconds':>8} {'429s':>5}")
+    for rate_limit in (None, RATE_LIMIT):
+        label = 'none' if rate_limit is None else f"{rate_limit}/{RATE_WINDOW:g}s"
+        for workers in WORKERS:
+            elapsed, limited = run(workers, rate_limit)
+            print(f"{label:>14} {workers:>8} {elapsed:>8.2f} {limited:>5}")
+
+
+if __name__ == '__main__':
+    main()
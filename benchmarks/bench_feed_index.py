@@ -0,0 +1,46 @@
+# Micro-benchmark: matching active DB items against the NB511 feed in close_recent_events.
+# Compares the old per-item list-comprehension search against the index_feed dict lookup.
+# Run from the repository root (config.json must exist): python benchmarks/bench_feed_index.py
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import scrape
+
+# (feed size, active items in the table)
+CASES = [(1000, 50), (2500, 150), (5000, 300), (10000, 600)]
+REPEAT = 5
+
+
+def make_feed(size):
+    return [{'ID': i, 'IsFullClosure': i % 10 == 0} for i in range(size)]
+
+
+def list_search(data, active_ids):
+    # The lookup close_recent_events used to do for each active item
+    for event_id in active_ids:
+        [x for x in data if str(x['ID']) == event_id]
+
+
+def indexed_search(data, active_ids):
+    feed_by_id = scrape.index_feed(data)
+    for event_id in active_ids:
+        feed_by_id.get(event_id)
+
+
+def main():
+    print(f"{'feed':>7} {'active':>7} {'list search ms':>15} {'indexed ms':>11} {'speedup':>8}")
+    for size, active in CASES:
+        data = make_feed(size)
+        active_ids = [str(i) for i in range(0, size, size // active)][:active]
+        old = min(timeit.repeat(lambda: list_search(data, active_ids), number=1, repeat=REPEAT))
+        new = min(timeit.repeat(lambda: indexed_search(data, active_ids), number=1, repeat=REPEAT))
+        print(f"{size:>7} {active:>7} {old * 1000:>15.2f} {new * 1000:>11.3f} {old / new:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Benchmark: peak memory of the buffered and streaming feed parsers on a storm-sized payload.
+# Run from the repository root (config.json must exist): python benchmarks/bench_feed_memory.py
+import io
+import json
+import os
+import sys
+import tracemalloc
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import scrape
+
+EVENT_COUNTS = [2000, 10000, 20000]
+CLOSURE_RATIO = 0.05
+
+
+def make_payload(count):
+    events = [{
+        'ID': i,
+        'RoadwayName': f"Route {i % 200}",
+        'DirectionOfTravel': 'Both Directions',
+        'Description': 'Flooding. Road closed between exits. Detour in effect via local roads. ' * 3,
+        'LastUpdated': 1735406658, 'StartDate': 1735406520, 'PlannedEndDate': None,
+        'Latitude': 45.9 + i / 1e5, 'Longitude': -66.6 - i / 1e5,
+        'EventType': 'closures', 'IsFullClosure': i % int(1 / CLOSURE_RATIO) == 0,
+        'Comment': None, 'Restrictions': {'Width': None, 'Height': None, 'Weight': None},
+    } for i in range(count)]
+    return json.dumps(events).encode()
+
+
+def peak_memory(parse):
+    tracemalloc.start()
+    feed = parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, len(feed.full_closures)
+
+
+def main():
+    print(f"{'events':>8} {'payload MB':>11} {'buffered peak MB':>17} {'streaming peak MB':>18}")
+    for count in EVENT_COUNTS:
+        payload = make_payload(count)
+
+        def buffered():
+            response = Mock()
+            response.content = bytes(payload)
+            return scrape.Feed.from_response(response)
+
+        def streaming():
+            response = Mock()
+            response.raw = io.BytesIO(payload)
+            return scrape.Feed.from_stream(response)
+
+        # The buffered parser also holds the body it was handed, so count it against that mode
+        buffered_peak, closures = peak_memory(buffered)
+        streaming_peak, streamed_closures = peak_memory(streaming)
+        assert closures == streamed_closures
+        print(f"{count:>8} {len(payload) / 1e6:>11.1f} {buffered_peak / 1e6:>17.1f} {streaming_peak / 1e6:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
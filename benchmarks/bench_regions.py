@@ -0,0 +1,83 @@
+# Micro-benchmark: classifying feed events into regions.
+# Compares the old sequential Polygon.contains loop (one Point per event) against RegionClassifier
+# (STRtree + vectorized contains_xy), cold and with its per-coordinate cache warm.
+# Regions are a jittered grid of polygons over New Brunswick; points are spread over the province.
+# Run from the repository root (config.json must exist): python benchmarks/bench_regions.py
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from shapely.geometry import Point, Polygon
+
+import scrape
+
+# Rough bounding box of New Brunswick, (lat, lon)
+LAT_RANGE = (45.0, 48.1)
+LON_RANGE = (-69.1, -63.7)
+# (regions, points)
+CASES = [(8, 500), (15, 2000), (30, 5000), (60, 10000)]
+REPEAT = 5
+
+
+def make_regions(count):
+    # A grid of cells, each a 24-vertex ring with jittered radius, so the polygons are not boxes
+    random.seed(count)
+    columns = int(count ** 0.5) + 1
+    rows = -(-count // columns)
+    cell_lat = (LAT_RANGE[1] - LAT_RANGE[0]) / rows
+    cell_lon = (LON_RANGE[1] - LON_RANGE[0]) / columns
+    regions = {}
+    for index in range(count):
+        row, column = divmod(index, columns)
+        center = (LAT_RANGE[0] + (row + 0.5) * cell_lat, LON_RANGE[0] + (column + 0.5) * cell_lon)
+        ring = []
+        for step in range(24):
+            angle = step / 24 * 2 * math.pi
+            scale = random.uniform(0.4, 0.6)
+            ring.append((center[0] + scale * cell_lat * math.sin(angle),
+                         center[1] + scale * cell_lon * math.cos(angle)))
+        regions[f"Region {index}"] = Polygon(ring)
+    return regions
+
+
+def make_points(count):
+    random.seed(count)
+    return [(random.uniform(*LAT_RANGE), random.uniform(*LON_RANGE)) for _ in range(count)]
+
+
+def sequential(regions, points):
+    # What check_which_polygon_point used to do for each event
+    result = []
+    for lat, lon in points:
+        point = Point(lat, lon)
+        for name, polygon in regions.items():
+            if polygon.contains(point):
+                result.append(name)
+                break
+        else:
+            result.append('Other')
+    return result
+
+
+def main():
+    print(f"{'regions':>8} {'points':>7} {'sequential ms':>14} {'classifier ms':>14} {'cached ms':>10} {'speedup':>8}")
+    for region_count, point_count in CASES:
+        regions = make_regions(region_count)
+        points = make_points(point_count)
+        assert scrape.RegionClassifier(regions).classify(points) == sequential(regions, points)
+        old = min(timeit.repeat(lambda: sequential(regions, points), number=1, repeat=REPEAT))
+        cold = min(timeit.repeat(lambda: scrape.RegionClassifier(regions).classify(points), number=1, repeat=REPEAT))
+        classifier = scrape.RegionClassifier(regions)
+        classifier.classify(points)
+        warm = min(timeit.repeat(lambda: classifier.classify(points), number=1, repeat=REPEAT))
+        print(f"{region_count:>8} {point_count:>7} {old * 1000:>14.1f} {cold * 1000:>14.1f} {warm * 1000:>10.2f} {old / cold:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
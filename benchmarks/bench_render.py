@@ -0,0 +1,71 @@
+# Micro-benchmark: rendering Discord notifications to JSON payloads.
+# Times render_payload for each embed kind and, if discord_webhook is installed, the old
+# DiscordWebhook/DiscordEmbed construction it replaced. No network calls are made.
+# Run from the repository root (config.json must exist): python benchmarks/bench_render.py
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import scrape
+
+try:
+    from discord_webhook import DiscordWebhook, DiscordEmbed
+except ImportError:
+    DiscordWebhook = None
+
+NUMBER = 2000
+REPEAT = 5
+
+
+def load_event():
+    with open('tests/fixtures/embed_snapshots.json', 'r') as f:
+        snapshots = json.load(f)
+    return snapshots['event']
+
+
+def old_closure(event):
+    # The construction post_to_discord_closure did for every message
+    webhook = DiscordWebhook(url=scrape.DISCORD_WEBHOOK_URL, username=scrape.discordUsername,
+                             avatar_url=scrape.discordAvatarURL, thread_id=scrape.getThreadID(None))
+    urlWME = f"https://www.waze.com/en-GB/editor?env=usa&lon={event['Longitude']}&lat={event['Latitude']}&zoomLevel=15"
+    url511 = f"https://511.gnb.ca/map#Closures-{event['ID']}"
+    urlLivemap = f"https://www.waze.com/live-map/directions?dir_first=no&latlng={event['Latitude']}%2C{event['Longitude']}&overlay=false&zoom=16"
+    embed = DiscordEmbed(title="Closed", color=15548997)
+    embed.add_embed_field(name="Road", value=event['RoadwayName'])
+    embed.add_embed_field(name="Direction", value=event['DirectionOfTravel'])
+    embed.add_embed_field(name="Information", value=event['Description'], inline=False)
+    embed.add_embed_field(name="Start Time", value=scrape.unix_to_readable(event['StartDate']))
+    embed.add_embed_field(name="Planned End Time", value=scrape.unix_to_readable(event['PlannedEndDate']))
+    embed.add_embed_field(name="Links", value=f"[511]({url511}) | [WME]({urlWME}) | [Livemap]({urlLivemap})", inline=False)
+    embed.set_footer(text=scrape.config['license_notice'])
+    embed.set_timestamp(datetime.utcfromtimestamp(int(event['StartDate'])))
+    webhook.add_embed(embed)
+    return json.dumps(webhook.json)
+
+
+def time_per_message(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=REPEAT)) / NUMBER * 1e6
+
+
+def main():
+    event = load_event()
+    item = dict(event, EventID=event['ID'], lastTouched=event['StartDate'])
+    print(f"{'kind':>12} {'render us':>10}")
+    for kind in scrape.EMBED_KINDS:
+        subject = item if kind == 'completed' else event
+        elapsed = time_per_message(lambda: json.dumps(scrape.render_payload(kind, subject)))
+        print(f"{kind:>12} {elapsed:>10.1f}")
+    if DiscordWebhook is not None:
+        old = time_per_message(lambda: old_closure(event))
+        new = time_per_message(lambda: json.dumps(scrape.render_payload('closure', event)))
+        print(f"closure via DiscordWebhook/DiscordEmbed: {old:.1f} us, render_payload: {new:.1f} us ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
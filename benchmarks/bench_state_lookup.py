@@ -0,0 +1,72 @@
+# Benchmark: DynamoDB round trips for the state lookup in check_and_post_events.
+# Compares the old per-event query against the batched load_active_events, using moto.
+# Run from the repository root (config.json must exist): python benchmarks/bench_state_lookup.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DISCORD_WEBHOOK', 'https://mock-discord-webhook.com/bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from moto import mock_aws
+from unittest.mock import patch
+
+import scrape
+
+SIZES = [10, 100, 500, 1000]
+
+
+def create_table(event_count):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='bench-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    with table.batch_writer() as batch:
+        for i in range(event_count):
+            batch.put_item(Item={'EventID': str(i), 'isActive': 1})
+    return table
+
+
+def per_event_lookup(table, event_ids):
+    # The lookup check_and_post_events used to do: one query per full closure
+    return {
+        event_id: table.query(
+            KeyConditionExpression=Key('EventID').eq(event_id),
+            FilterExpression=Attr('isActive').eq(1),
+            ConsistentRead=True
+        )['Items']
+        for event_id in event_ids
+    }
+
+
+def measure(table, lookup):
+    calls = []
+    handler = lambda model, **kwargs: calls.append(model.name)
+    table.meta.client.meta.events.register('before-call.dynamodb', handler)
+    start = time.perf_counter()
+    lookup()
+    elapsed = time.perf_counter() - start
+    table.meta.client.meta.events.unregister('before-call.dynamodb', handler)
+    return len(calls), elapsed
+
+
+def main():
+    print(f"{'events':>8} {'per-event calls':>16} {'per-event ms':>13} {'batched calls':>14} {'batched ms':>11}")
+    for size in SIZES:
+        with mock_aws():
+            table = create_table(size)
+            event_ids = [str(i) for i in range(size)]
+            old_calls, old_time = measure(table, lambda: per_event_lookup(table, event_ids))
+            with patch('closurebot.store.table', table):
+                new_calls, new_time = measure(table, lambda: scrape.load_active_events(event_ids))
+        print(f"{size:>8} {old_calls:>16} {old_time * 1000:>13.1f} {new_calls:>14} {new_time * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/bin/bash
+# Build the Lambda image for a baseline git ref and for the working tree, then print a markdown
+# table of image size and the median time to import scrape in a fresh container (the work a cold
+# start does before lambda_handler runs). Used by CI for the job summary.
+# Usage: benchmarks/image_report.sh [baseline-ref]    (default: HEAD~1; needs docker and config.json)
+set -euo pipefail
+
+BASELINE_REF=${1:-HEAD~1}
+if ! git rev-parse --verify --quiet "${BASELINE_REF}^{commit}" > /dev/null; then
+    BASELINE_REF=HEAD~1
+fi
+RUNS=5
+BASELINE_DIR=$(mktemp -d)
+trap 'git worktree remove --force "$BASELINE_DIR" > /dev/null 2>&1 || true' EXIT
+
+git worktree add --detach "$BASELINE_DIR" "$BASELINE_REF" > /dev/null 2>&1
+cp config.json "$BASELINE_DIR/config.json"
+
+docker build -q -t closurebot:baseline "$BASELINE_DIR" > /dev/null
+docker build -q -t closurebot:current . > /dev/null
+
+size_mb() {
+    docker image inspect -f '{{.Size}}' "$1" | awk '{printf "%.1f", $1 / 1048576}'
+}
+
+import_ms() {
+    for _ in $(seq "$RUNS"); do
+        docker run --rm --entrypoint python \
+            -e DISCORD_WEBHOOK=https://discord.invalid/api/webhooks/0/x -e AWS_DEFAULT_REGION=us-east-1 \
+            "$1" -c "import time; t = time.perf_counter(); import scrape; print((time.perf_counter() - t) * 1000)"
+    done | sort -n | awk '{a[NR] = $1} END {printf "%.0f", a[int((NR + 1) / 2)]}'
+}
+
+echo "### Lambda image: $(git rev-parse --short "$BASELINE_REF") vs $(git rev-parse --short HEAD)"
+echo
+echo "| image | size (MB) | import scrape, median of $RUNS (ms) |"
+echo "|---|---|---|"
+echo "| baseline | $(size_mb closurebot:baseline) | $(import_ms closurebot:baseline) |"
+echo "| current | $(size_mb closurebot:current) | $(import_ms closurebot:current) |"
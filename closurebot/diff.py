@@ -0,0 +1,190 @@
+# Diffing a feed against the stored active events, and the notifications and writes that follow.
+import json
+import hashlib
+import logging
+from decimal import Decimal
+from collections import namedtuple
+
+from closurebot import runtime, store
+from closurebot.runtime import config, update_utc_timestamp
+from closurebot.geo import classify_regions
+from closurebot.store import (
+    ACTIVE_INDEX_ATTRIBUTE, ACTIVE_INDEX_VALUE, EXPIRY_ATTRIBUTE, RETENTION_SECONDS, WriteBuffer, iter_active_events
+)
+from closurebot.notify import (
+    post_to_discord_closure, post_to_discord_planned_closure, post_to_discord_closure_now_active,
+    post_to_discord_updated, post_to_discord_completed
+)
+
+__all__ = [
+    'DIGEST_FIELDS', 'digest_value', 'event_digest', 'stored_digest', 'EventDiff', 'classify_events',
+    'process_events', 'close_recent_events'
+]
+
+# Fields shown in the Discord embeds; a change to any of them is worth an update notification
+DIGEST_FIELDS = [
+    'RoadwayName', 'DirectionOfTravel', 'Description', 'StartDate', 'PlannedEndDate', 'Comment', 'IsFullClosure'
+]
+
+def digest_value(value):
+    # Normalize numbers so a value parsed from the feed and the same value read back from DynamoDB
+    # (as Decimal, possibly stored from a float) produce the same digest
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return int(value) if value == int(value) else str(value)
+    return value
+
+def event_digest(event):
+    # Digest of the fields shown in the Discord embeds
+    values = [digest_value(event.get(field)) for field in DIGEST_FIELDS]
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+def stored_digest(item):
+    # Items written before digests were stored get theirs computed from the stored fields
+    return item.get('ContentDigest') or event_digest(item)
+
+EventDiff = namedtuple('EventDiff', ['new', 'changed', 'unchanged', 'gone'])
+
+def classify_events(current, previous):
+    # Diff two {event_id: digest} snapshots, returning an EventDiff of ID sets
+    common = current.keys() & previous.keys()
+    changed = {event_id for event_id in common if current[event_id] != previous[event_id]}
+    return EventDiff(
+        new=current.keys() - previous.keys(),
+        changed=changed,
+        unchanged=common - changed,
+        gone=previous.keys() - current.keys()
+    )
+
+def process_events(feed, store, last_seen_at=None, seen_ids=None):
+    # One pass over the active items gives the previous snapshot for the whole diff, which is returned
+    active_states = store.load_active()
+
+    #use the feed to close out anything recent
+    close_recent_events(feed, store, last_seen_at, active_states.values(), seen_ids)
+
+    current_digests = {event_id: event_digest(event) for event_id, event in feed.full_closures.items()}
+    diff = classify_events(current_digests, {event_id: stored_digest(item) for event_id, item in active_states.items()})
+    if diff.new:
+        # The snapshot can come from an eventually consistent read, so let the store confirm the new events
+        active_states.update(store.confirm_new(diff.new))
+        diff = classify_events(current_digests, {event_id: stored_digest(item) for event_id, item in active_states.items()})
+    logging.info(f"Feed diff: {len(diff.new)} new, {len(diff.changed)} changed, {len(diff.unchanged)} unchanged, {len(diff.gone)} gone")
+    # Classify the whole feed into regions in one call
+    regions = classify_regions(feed.full_closures)
+
+    # Iterate over the full closures
+    for event_id, event in feed.full_closures.items():
+        # Look up the stored active state from the snapshot above
+        stored = active_states.get(event_id)
+        event['ContentDigest'] = current_digests[event_id]
+        #If the event is not in the DynamoDB table
+        update_utc_timestamp()
+        
+        # Determine if this is a planned (future) closure (>1 hour in future)
+        one_hour_from_now = runtime.utc_timestamp + 3600
+        is_planned_closure = event['StartDate'] > one_hour_from_now
+        
+        if event_id in diff.new:
+            # Set the EventID key in the event data
+            event['EventID'] = str(event['ID'])
+            # Set the isActive attribute
+            event['isActive'] = 1
+            event[ACTIVE_INDEX_ATTRIBUTE] = ACTIVE_INDEX_VALUE
+            # set LastTouched
+            event['lastTouched'] = runtime.utc_timestamp
+            event['DetectedPolygon'] = regions[event_id]
+            # Store whether this was initially a planned closure
+            event['wasPlannedClosure'] = 1 if is_planned_closure else 0
+            # Post to Discord based on whether it's planned or active
+            if is_planned_closure:
+                post_to_discord_planned_closure(event, event['DetectedPolygon'])
+                logging.info(f"EventID: {event['ID']} - Posted as PLANNED closure (starts in {(event['StartDate'] - runtime.utc_timestamp) / 3600:.1f} hours)")
+            else:
+                post_to_discord_closure(event, event['DetectedPolygon'])
+                logging.info(f"EventID: {event['ID']} - Posted as ACTIVE closure")
+            # Add the event ID to the DynamoDB table
+            store.put(event)
+        else:
+            # We have seen this event before
+            # Check if this was a planned closure that has now become active
+            became_active = False
+            was_planned = stored.get('wasPlannedClosure', 0)
+            stored_start_date = stored.get('StartDate')
+            current_start_date = int(event['StartDate'])
+            
+            # If it was planned and start time has now passed, notify that it's now active
+            # Check both stored and current start date to handle cases where the start date might have been updated
+            if was_planned == 1 and stored_start_date:
+                stored_start = int(stored_start_date) if isinstance(stored_start_date, (int, Decimal)) else int(float(str(stored_start_date)))
+                if stored_start <= runtime.utc_timestamp or current_start_date <= runtime.utc_timestamp:
+                    logging.info(f"EventID: {event['ID']} - Planned closure is now ACTIVE")
+                    event['EventID'] = str(event['ID'])
+                    event['isActive'] = 1
+                    event[ACTIVE_INDEX_ATTRIBUTE] = ACTIVE_INDEX_VALUE
+                    event['lastTouched'] = runtime.utc_timestamp
+                    event['DetectedPolygon'] = regions[event_id]
+                    event['wasPlannedClosure'] = 0  # Mark as no longer planned
+                    # Post that the closure is now active; it gets a new message, which later edits go to
+                    post_to_discord_closure_now_active(event, event['DetectedPolygon'])
+                    store.put(event)
+                    became_active = True
+            
+            # Check for regular updates: a field shown in the embeds has changed since we stored it
+            if event_id in diff.changed:
+                event['EventID'] = str(event['ID'])
+                event['isActive'] = 1
+                event[ACTIVE_INDEX_ATTRIBUTE] = ACTIVE_INDEX_VALUE
+                event['lastTouched'] = runtime.utc_timestamp
+                event['DetectedPolygon'] = regions[event_id]
+                # Preserve the wasPlannedClosure flag if it exists
+                if 'wasPlannedClosure' not in event:
+                    event['wasPlannedClosure'] = stored.get('wasPlannedClosure', 0)
+                # Keep the message the update edits, unless the closure just got a new one as it became active
+                if 'DiscordMessageID' in stored and not became_active:
+                    event['DiscordMessageID'] = stored['DiscordMessageID']
+                # It's different, so we should fire an update notification
+                post_to_discord_updated(event,event['DetectedPolygon'])
+                store.put(event)
+    return diff
+
+def close_recent_events(feed, writes=None, last_seen_at=None, active_items=None, seen_ids=None):
+    #function uses the parsed NB511 Feed to determine what we stored in the DB that can now be closed
+    #if it finds a closure no longer listed in the feed, then it marks it closed and posts to discord
+    #writes are queued on the given WriteBuffer or state store; without one, a buffer is created and flushed here
+    #last_seen_at is when the previous feed was last confirmed, and seen_ids the closures it listed;
+    #a closure in seen_ids (or any closure, without seen_ids) ended at last_seen_at rather than lastTouched
+    #active_items are the stored active items, read from the table when not given
+    if writes is None:
+        writes = WriteBuffer(store.table)
+        try:
+            return close_recent_events(feed, writes, last_seen_at, active_items, seen_ids)
+        finally:
+            writes.flush()
+    if active_items is None:
+        active_items = iter_active_events(config.get('scan_segments', 1), config.get('active_index_name'))
+
+    # Iterate over the active items in the table
+    for item in active_items:
+        markCompleted = False
+        event = feed.by_id.get(item['EventID'])
+        # If an item's ID is no longer in the feed, mark it as closed
+        if event is None:
+            markCompleted = True
+        elif event['IsFullClosure'] is False:
+            # item exists, but it's no longer a full closure - mark it as closed.
+            markCompleted = True
+        # process relevant completions
+        if markCompleted == True:
+            # lastTouched is only written when the closure changes; the run-level marker says when it was last seen
+            seen_last_run = seen_ids is None or str(item['EventID']) in seen_ids
+            if seen_last_run and last_seen_at is not None and last_seen_at > item.get('lastTouched', 0):
+                item['lastTouched'] = last_seen_at
+            # Mark the item inactive and drop it from the active-events index
+            # DynamoDB's TTL deletes it once the retention period has passed
+            writes.update(str(item['EventID']), {'isActive': 0, EXPIRY_ATTRIBUTE: runtime.utc_timestamp + RETENTION_SECONDS},
+                          remove=[ACTIVE_INDEX_ATTRIBUTE])
+            # Notify about closure on Discord
+            if 'DetectedPolygon' in item and item['DetectedPolygon'] is not None:
+                post_to_discord_completed(item,item['DetectedPolygon'])
+            else:
+                post_to_discord_completed(item)
@@ -0,0 +1,187 @@
+# Fetching a 511 feed: parsing the response into a Feed and the API rate limit.
+import json
+import time
+from decimal import Decimal
+import logging
+import hashlib
+import threading
+from functools import cached_property
+
+from closurebot import store
+from closurebot.runtime import config, NB511_FEED
+from closurebot.store import BATCH_MAX_RETRIES
+
+__all__ = [
+    'index_feed', 'parse_json', 'Feed', 'HashingReader', 'MemoryTokenBucket', 'DynamoTokenBucket',
+    'memory_token_buckets', 'api_rate_limiter', 'take_api_token'
+]
+
+# orjson is optional; it parses the NB511 payload several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ijson is optional; it is only needed for the streaming feed mode (stream_feed in config.json)
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def index_feed(data):
+    # Index the parsed NB511 events by ID. IDs are normalized to str to match the EventID key in DynamoDB.
+    return {str(event['ID']): event for event in data}
+
+def parse_json(raw):
+    # Parse a JSON payload (bytes or str), with orjson when it is installed
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+class Feed:
+    # One parsed NB511 event feed, shared by every stage of a run.
+    # Events keep their parsed float values; float_to_decimal is only applied to the
+    # items that are actually written to DynamoDB (see WriteBuffer.flush).
+    def __init__(self, events, raw=None, digest=None):
+        self.raw = raw
+        self.events = events
+        self.by_id = index_feed(events)
+        # sha256 of the response body, used to detect an unchanged feed
+        self.digest = digest
+
+    @classmethod
+    def from_response(cls, response):
+        # Parse the raw body bytes directly, skipping requests' text decoding
+        raw = response.content
+        return cls(parse_json(raw), raw=raw, digest=hashlib.sha256(raw).hexdigest())
+
+    @classmethod
+    def from_stream(cls, response):
+        # Parse a response opened with stream=True item by item, keeping only the full closures.
+        # Peak memory is then bounded by the closures rather than the whole feed. Dropping the
+        # other events is safe: close_recent_events treats an event that is missing and one that
+        # is no longer a full closure the same way.
+        if ijson is None:
+            logging.warning("stream_feed is enabled but ijson is not installed, parsing the whole response")
+            return cls.from_response(response)
+        response.raw.decode_content = True
+        body = HashingReader(response.raw)
+        closures = [
+            event for event in ijson.items(body, 'item', use_float=True)
+            if event['IsFullClosure']
+        ]
+        return cls(closures, digest=body.hash.hexdigest())
+
+    @cached_property
+    def full_closures(self):
+        # ID -> event for the full closures only, the only events the bot reports on
+        return {event_id: event for event_id, event in self.by_id.items() if event['IsFullClosure']}
+
+    def next_start_after(self, timestamp):
+        # Earliest StartDate of a full closure still in the future, i.e. when a planned closure becomes active
+        upcoming = [event['StartDate'] for event in self.full_closures.values() if event['StartDate'] > timestamp]
+        return min(upcoming, default=None)
+
+class HashingReader:
+    # File-like wrapper that hashes everything read through it, so a streamed body still gets a digest
+    def __init__(self, raw):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.hash.update(chunk)
+        return chunk
+
+class MemoryTokenBucket:
+    # Token bucket kept in this process, for a long-running poller. take() returns 0 when it took
+    # a token, otherwise the seconds until one is available.
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            return 0
+
+class DynamoTokenBucket:
+    # Token bucket kept in one item of the feed's table, so overlapping invocations, retries and
+    # manual runs all draw from the same tokens. Each take is a read and a conditional write on
+    # UpdatedAt; a run that loses the race reads the bucket again.
+    def __init__(self, table, capacity, rate, key='ApiRateLimit'):
+        self.table = table
+        self.capacity = capacity
+        self.rate = rate
+        self.key = key
+
+    def take(self):
+        from boto3.dynamodb.conditions import Attr
+        from botocore.exceptions import ClientError
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            item = self.table.get_item(Key={'EventID': self.key}, ConsistentRead=True).get('Item')
+            now = time.time()
+            if item is None:
+                tokens = self.capacity
+                condition = Attr('EventID').not_exists()
+            else:
+                elapsed = max(now - float(item['UpdatedAt']), 0)
+                tokens = min(self.capacity, float(item['Tokens']) + elapsed * self.rate)
+                condition = Attr('UpdatedAt').eq(item['UpdatedAt'])
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            try:
+                self.table.put_item(
+                    Item={'EventID': self.key, 'Tokens': Decimal(f"{tokens - 1:.6f}"), 'UpdatedAt': Decimal(f"{now:.6f}")},
+                    ConditionExpression=condition
+                )
+                return 0
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        raise Exception(f"Rate limit bucket {self.key} still contended after {BATCH_MAX_RETRIES} retries")
+
+# In-memory buckets by API URL, kept across runs of a long-running process
+memory_token_buckets = {}
+
+def api_rate_limiter():
+    # The token bucket for the current feed's API, or None when it has no api_rate_limit.
+    # The bucket holds up to `burst` tokens (default 1) and refills so that no window of
+    # `seconds` can see more than `calls` requests, however the calls are spread.
+    limit = config.get('api_rate_limit')
+    if not limit:
+        return None
+    burst = limit.get('burst', 1)
+    if limit['calls'] <= burst:
+        raise Exception('api_rate_limit calls must be greater than its burst')
+    rate = (limit['calls'] - burst) / limit['seconds']
+    if config.get('api_rate_limit_backend', 'dynamodb') == 'memory':
+        api_url = config.get('api_url', NB511_FEED['api_url'])
+        return memory_token_buckets.setdefault(api_url, MemoryTokenBucket(burst, rate))
+    return DynamoTokenBucket(store.table, burst, rate)
+
+def take_api_token(feed_name):
+    # Every feed fetch takes a token first. With api_rate_limit_policy "wait" (the default) a run
+    # waits up to api_rate_limit_max_wait seconds for one; "skip" gives up at once. Returns False
+    # when this poll should be skipped.
+    bucket = api_rate_limiter()
+    if bucket is None:
+        return True
+    max_wait = config.get('api_rate_limit_max_wait', 15) if config.get('api_rate_limit_policy', 'wait') == 'wait' else 0
+    deadline = time.monotonic() + max_wait
+    while True:
+        delay = bucket.take()
+        if delay == 0:
+            return True
+        if time.monotonic() + delay > deadline:
+            logging.warning(f"{feed_name} API rate limit reached, skipping this poll (next call allowed in {delay:.1f} s)")
+            return False
+        time.sleep(delay)
@@ -0,0 +1,809 @@
+# Discord notifications: rendering embeds, delivering webhook messages and the notification outbox.
+import json
+import time
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import logging
+import sqlite3
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import namedtuple
+
+from closurebot import runtime, store
+from closurebot.runtime import config, NB511_FEED, HTTP_TIMEOUT, update_utc_timestamp, submit_in_context
+from closurebot.store import (
+    OUTBOX_PREFIX, OUTBOX_INDEX_VALUE, ACTIVE_INDEX_ATTRIBUTE, EXPIRY_ATTRIBUTE, RETENTION_SECONDS,
+    scan_pages, query_pages, get_state_store, record_message_ids
+)
+
+__all__ = [
+    'DISCORD_WEBHOOK_URL', 'DISCORD_MAX_RETRIES', 'DISCORD_MAX_EMBEDS', 'DISCORD_MAX_EMBED_CHARS',
+    'OUTBOX_MAX_ATTEMPTS', 'OUTBOX_BASE_DELAY', 'OUTBOX_MAX_DELAY', 'discordUsername', 'discordAvatarURL',
+    'getThreadID', 'FRENCH_MONTHS', 'local_zone', 'format_timestamp', 'unix_to_readable', 'iso_timestamp',
+    'event_key', 'WebhookRateLimiter', 'webhook_rate_limiter', 'deliver_webhook', 'DeliveryPool',
+    'delivery_pool', 'dispatch_webhook', 'embed_length', 'EmbedBatcher', 'embed_batcher', 'active_outbox',
+    'previous_check', 'send_webhook', 'event_urls', 'ended_at', 'EMBED_FIELDS', 'EMBED_TIMESTAMPS',
+    'EmbedKind', 'EMBED_KINDS', 'render_embed', 'render_payload', 'webhook_url', 'DiscordMessage',
+    'notification_id', 'post_to_discord', 'post_to_discord_closure', 'post_to_discord_planned_closure',
+    'post_to_discord_closure_now_active', 'post_to_discord_updated', 'post_to_discord_completed',
+    'get_outbox', 'outbox_retry_delay', 'Outbox', 'DynamoOutbox', 'SqliteOutbox', 'deliver_chain',
+    'drain_outbox', 'outbox_message'
+]
+
+DISCORD_WEBHOOK_URL = os.environ['DISCORD_WEBHOOK']
+
+# Retries for a Discord message answered with 429 before giving up
+DISCORD_MAX_RETRIES = 5
+# Discord's per-message limits, used when batch_embeds packs notifications together
+DISCORD_MAX_EMBEDS = 10
+DISCORD_MAX_EMBED_CHARS = 6000
+# Outbox delivery: attempts before a notification is dead-lettered, and the backoff between them (seconds)
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BASE_DELAY = 60
+OUTBOX_MAX_DELAY = 3600
+
+discordUsername = "NB511"
+discordAvatarURL = "https://pbs.twimg.com/profile_images/1085255845187702784/i-t0qacA_400x400.jpg"
+
+def getThreadID(threadName):
+    # TODO: When NB regions are defined, uncomment and update thread mappings
+    # For now, all events go to catch-all thread
+    # if threadName == 'GTA':
+    #     return config['Thread-GTA']
+    # elif threadName == 'Central & Eastern Ontario':
+    #     return config['Thread-Central_EasternOntario']
+    # elif threadName == 'Northern Ontario':
+    #     return config['Thread-NorthernOntario']
+    # elif threadName == 'Southern Ontario':
+    #     return config['Thread-SouthernOntario']
+    # else:
+    return config['Thread-CatchAll'] #Other catch all thread
+
+# Month abbreviations for French dates, so the output does not depend on the host's locale
+FRENCH_MONTHS = ['janv.', 'févr.', 'mars', 'avr.', 'mai', 'juin',
+                 'juil.', 'août', 'sept.', 'oct.', 'nov.', 'déc.']
+
+@lru_cache(maxsize=None)
+def local_zone(name):
+    # Resolve a timezone once; ZoneInfo reads the tz database from disk on a miss
+    return ZoneInfo(name)
+
+@lru_cache(maxsize=4096)
+def format_timestamp(unix_timestamp, zone_name, language):
+    # Readable local time for embeds. An event's start and end times are rendered again for
+    # every update, so repeated timestamps come from the cache.
+    local_time = datetime.fromtimestamp(unix_timestamp, local_zone(zone_name))
+    english = local_time.strftime('%Y-%b-%d %I:%M %p')
+    french = f"{local_time.year}-{FRENCH_MONTHS[local_time.month - 1]}-{local_time.day:02d} " \
+             f"{local_time.hour:02d} h {local_time.minute:02d}"
+    if language == 'fr':
+        return french
+    if language == 'bilingual':
+        return f"{english} / {french}"
+    return english
+
+def unix_to_readable(unix_timestamp):
+    return format_timestamp(int(unix_timestamp), config['timezone'], config.get('date_language', 'en'))
+
+def iso_timestamp(unix_timestamp):
+    # Embed timestamp: ISO 8601 in UTC, without an offset as Discord has always received it
+    return datetime.fromtimestamp(int(unix_timestamp), timezone.utc).replace(tzinfo=None).isoformat()
+
+def event_key(event):
+    # Key that keeps an event's notifications in order; stored items carry EventID, feed events ID
+    return str(event.get('EventID', event.get('ID')))
+
+class WebhookRateLimiter:
+    # Tracks Discord's rate limit per webhook URL from the X-RateLimit-* headers and 429 responses,
+    # shared by every thread that sends to the same webhook. Each send reserves one request from the
+    # bucket, so concurrent senders wait for the reset instead of collecting 429s. Until the first
+    # response shows the limit, only one request is sent.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def wait(self, url):
+        while True:
+            with self.lock:
+                bucket = self.buckets.setdefault(url, {
+                    'limit': None, 'remaining': 0, 'reset_at': 0.0, 'window': 0.0, 'state': 'new'
+                })
+                now = time.monotonic()
+                if bucket['state'] == 'new':
+                    bucket['state'] = 'probing'
+                    return
+                if bucket['state'] == 'unlimited':
+                    return
+                if bucket['state'] == 'limited':
+                    if now >= bucket['reset_at']:
+                        # The window has passed; refill from the last known limit
+                        bucket['remaining'] = bucket['limit']
+                        bucket['reset_at'] = now + bucket['window']
+                    if bucket['remaining'] > 0:
+                        bucket['remaining'] -= 1
+                        return
+                    delay = bucket['reset_at'] - now
+                else:
+                    # Another thread is probing for the limit
+                    delay = 0.05
+            time.sleep(delay)
+
+    def update(self, url, response):
+        with self.lock:
+            bucket = self.buckets.setdefault(url, {
+                'limit': None, 'remaining': 0, 'reset_at': 0.0, 'window': 0.0, 'state': 'new'
+            })
+            now = time.monotonic()
+            if response.status_code == 429:
+                # retry_after is in seconds; fall back to the Retry-After header
+                try:
+                    delay = float(response.json()['retry_after'])
+                except (ValueError, KeyError, TypeError):
+                    delay = float(response.headers.get('Retry-After', 1))
+                bucket.update(state='limited', remaining=0, reset_at=max(bucket['reset_at'], now + delay))
+                bucket['limit'] = bucket['limit'] or 1
+                bucket['window'] = max(bucket['window'], delay)
+            elif response.headers.get('X-RateLimit-Remaining') is not None:
+                reset_after = float(response.headers.get('X-RateLimit-Reset-After', 1))
+                remaining = int(response.headers['X-RateLimit-Remaining'])
+                if bucket['state'] == 'limited' and now < bucket['reset_at']:
+                    # Requests reserved since this one was sent are not in the header count yet
+                    remaining = min(remaining, bucket['remaining'])
+                bucket.update(
+                    state='limited',
+                    limit=int(response.headers.get('X-RateLimit-Limit', remaining + 1)),
+                    remaining=remaining,
+                    reset_at=now + reset_after,
+                    window=max(bucket['window'], reset_after)
+                )
+            elif bucket['state'] == 'probing':
+                bucket['state'] = 'unlimited'
+
+    def failed(self, url):
+        # A send that raised never got a response; let the next one probe again
+        with self.lock:
+            if self.buckets.get(url, {}).get('state') == 'probing':
+                self.buckets[url]['state'] = 'new'
+
+webhook_rate_limiter = WebhookRateLimiter()
+
+def deliver_webhook(webhook):
+    # Execute a webhook, waiting out Discord's rate limit and retrying when it answers 429.
+    # Any other error reply raises, so the message counts as failed on every delivery path.
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        webhook_rate_limiter.wait(webhook.url)
+        try:
+            response = webhook.execute()
+        except Exception:
+            webhook_rate_limiter.failed(webhook.url)
+            raise
+        webhook_rate_limiter.update(webhook.url, response)
+        if response.status_code != 429:
+            if not response.ok:
+                raise Exception(f"Discord webhook returned {response.status_code}")
+            return response
+        logging.warning(f"Discord rate limited the webhook, retrying (attempt {attempt + 1})")
+    raise Exception(f"Discord webhook still rate limited after {DISCORD_MAX_RETRIES} retries")
+
+class DeliveryPool:
+    # Sends webhook messages concurrently on a thread pool while the diff loop keeps going.
+    # Messages with the same key are chained so they arrive in order; different keys run in parallel.
+    # Leaving the context waits for every message and re-raises the first delivery error.
+    # message_ids collects the IDs of posted messages that are kept on their event, and
+    # failed_keys the events with a message that could not be delivered.
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.chains = {}
+        self.message_ids = {}
+        self.failed_keys = set()
+
+    def submit(self, webhook, key):
+        previous = self.chains.get(key)
+        self.chains[key] = submit_in_context(self.executor, self.deliver_after, previous, webhook, key)
+
+    def deliver_after(self, previous, webhook, key):
+        # A key's previous message was submitted earlier, so it is already running or done
+        if previous is not None:
+            previous.exception()
+        try:
+            response = deliver_webhook(webhook)
+        except Exception:
+            # A batch is chained per thread but carries the keys of the events it holds
+            self.failed_keys.update(webhook.event_keys or [key])
+            raise
+        if webhook.posted_id is not None:
+            # Chained per event, so the newest message for an event is recorded last
+            self.message_ids[webhook.record_for] = webhook.posted_id
+        return response
+
+    def __enter__(self):
+        self.token = delivery_pool.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        delivery_pool.reset(self.token)
+        self.executor.shutdown(wait=True)
+        errors = [future.exception() for future in self.chains.values() if future.exception()]
+        for error in errors:
+            logging.error(f"Discord delivery failed: {error}")
+        if errors and exc_type is None:
+            raise errors[0]
+
+# The DeliveryPool active for the current run; without one, messages are sent inline.
+# Run state is kept in context variables, so feeds running concurrently keep theirs apart.
+delivery_pool = contextvars.ContextVar('delivery_pool', default=None)
+
+def dispatch_webhook(webhook, key):
+    # Hand a message to the active delivery pool, or send it right away
+    pool = delivery_pool.get()
+    if pool is not None:
+        pool.submit(webhook, key)
+    else:
+        deliver_webhook(webhook)
+
+def embed_length(embed):
+    # Characters Discord counts toward a message's embed total
+    length = len(embed.get('title') or '') + len(embed.get('description') or '')
+    length += len((embed.get('footer') or {}).get('text') or '')
+    length += len((embed.get('author') or {}).get('name') or '')
+    for field in embed.get('fields') or []:
+        length += len(str(field.get('name') or '')) + len(str(field.get('value') or ''))
+    return length
+
+class EmbedBatcher:
+    # Packs the embeds of queued notifications into as few messages as possible per thread,
+    # up to Discord's 10 embeds and 6000 characters per message. A full batch is sent as soon
+    # as the next embed would not fit; the rest go out when the run flushes the batcher.
+    def __init__(self, dispatch=dispatch_webhook):
+        self.dispatch = dispatch
+        self.pending = {}
+
+    def add(self, webhook, key=None):
+        thread_id = webhook.thread_id
+        for index, embed in enumerate(webhook.embeds):
+            length = embed_length(embed)
+            batch = self.pending.get(thread_id)
+            if batch and (len(batch['embeds']) >= DISCORD_MAX_EMBEDS
+                          or batch['length'] + length > DISCORD_MAX_EMBED_CHARS):
+                self.send(thread_id)
+                batch = None
+            if batch is None:
+                batch = self.pending[thread_id] = {'webhook': webhook, 'embeds': [], 'length': 0, 'entries': [], 'keys': []}
+            if index == 0:
+                batch['entries'].extend(webhook.entries)
+                if key is not None:
+                    batch['keys'].append(key)
+            batch['embeds'].append(embed)
+            batch['length'] += length
+
+    def send(self, thread_id):
+        # The first webhook queued for the thread carries the batch; they all share url, name and thread
+        batch = self.pending.pop(thread_id)
+        webhook = batch['webhook']
+        webhook.embeds = batch['embeds']
+        webhook.entries = batch['entries']
+        webhook.event_keys = batch['keys']
+        # Batches for one thread are chained so they keep the order the embeds were queued in
+        self.dispatch(webhook, f"thread:{thread_id}")
+
+    def flush(self):
+        for thread_id in list(self.pending):
+            self.send(thread_id)
+
+    def __enter__(self):
+        self.token = embed_batcher.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        embed_batcher.reset(self.token)
+        # Whatever was queued belongs to state this run saves, so send it even if the run failed
+        self.flush()
+
+# The EmbedBatcher active for the current run when batch_embeds is on
+embed_batcher = contextvars.ContextVar('embed_batcher', default=None)
+
+# The Outbox recording the current run's notifications when outbox_backend is set
+active_outbox = contextvars.ContextVar('active_outbox', default=None)
+
+# CheckedAt of the feed cache the current run diffs against
+previous_check = contextvars.ContextVar('previous_check', default=None)
+
+def send_webhook(webhook, key, notification_id=None):
+    # Queue a notification: into the run's outbox, into the active batch, otherwise as its own message
+    outbox, batcher = active_outbox.get(), embed_batcher.get()
+    if outbox is not None:
+        outbox.add(webhook, key, notification_id)
+    elif batcher is not None and webhook.batchable:
+        batcher.add(webhook, key)
+    else:
+        dispatch_webhook(webhook, key)
+
+def event_urls(event):
+    # Map links for an event; anything that is not an incident is listed under closures on 511
+    url_type = 'Incidents' if event.get('EventType') == 'accidentsAndIncidents' else 'Closures'
+    return {
+        '511': config.get('map_url', NB511_FEED['map_url']).format(url_type=url_type, id=event.get('ID')),
+        'WME': f"https://www.waze.com/en-GB/editor?env=usa&lon={event['Longitude']}&lat={event['Latitude']}&zoomLevel=15",
+        'Livemap': f"https://www.waze.com/live-map/directions?dir_first=no&latlng={event['Latitude']}%2C{event['Longitude']}&overlay=false&zoom=16",
+    }
+
+def ended_at(event):
+    # When a cleared event was last seen in the feed
+    return int(event['lastTouched']) if 'lastTouched' in event else runtime.utc_timestamp
+
+# Embed fields by name: (value for an event, inline). A value of None leaves the field out.
+EMBED_FIELDS = {
+    'Road': (lambda event: event['RoadwayName'], True),
+    'Direction': (lambda event: event['DirectionOfTravel'], True),
+    'Information': (lambda event: event['Description'], False),
+    'Start Time': (lambda event: unix_to_readable(event['StartDate']), True),
+    'Planned Start Time': (lambda event: unix_to_readable(event['StartDate']), True),
+    'Planned End Time': (lambda event: unix_to_readable(event['PlannedEndDate'])
+                         if event.get('PlannedEndDate') is not None else None, True),
+    'Comment': (lambda event: event['Comment'] if event.get('Comment') is not None else None, False),
+    'Ended': (lambda event: unix_to_readable(ended_at(event)), True),
+}
+
+# Where each kind of embed takes its timestamp from
+EMBED_TIMESTAMPS = {
+    'start': lambda event: int(event['StartDate']),
+    'now': lambda event: runtime.utc_timestamp,
+    'updated': lambda event: int(event['LastUpdated']),
+    'ended': ended_at,
+}
+
+# edit: with edit_messages on, edit the event's Discord message instead of posting a new one.
+# track: keep the ID of the posted message, so the event's later edits go to it.
+EmbedKind = namedtuple('EmbedKind', ['title', 'color', 'fields', 'links', 'timestamp', 'edit', 'track'])
+
+# Every notification the bot posts, rendered by render_embed
+EMBED_KINDS = {
+    'closure': EmbedKind('Closed', 0xed4245,
+                         ['Road', 'Direction', 'Information', 'Start Time', 'Planned End Time'],
+                         ['511', 'WME', 'Livemap'], 'start', False, True),
+    # Blue for planned closures (informational/future)
+    'planned': EmbedKind('Planned Closure', 0x3498db,
+                         ['Road', 'Direction', 'Information', 'Planned Start Time', 'Planned End Time'],
+                         ['511', 'WME', 'Livemap'], 'now', False, True),
+    # Red to indicate a planned closure is now active
+    'now_active': EmbedKind('Closure Now Active', 0xed4245,
+                            ['Road', 'Direction', 'Information', 'Start Time', 'Planned End Time'],
+                            ['511', 'WME', 'Livemap'], 'now', False, True),
+    'updated': EmbedKind('Closure Update', 0xff9a00,
+                         ['Road', 'Direction', 'Information', 'Start Time', 'Planned End Time', 'Comment'],
+                         ['511', 'WME', 'Livemap'], 'updated', True, True),
+    'completed': EmbedKind('Cleared', 0x34e718,
+                           ['Road', 'Direction', 'Information', 'Start Time', 'Ended'],
+                           ['WME', 'Livemap'], 'ended', True, False),
+}
+
+def render_embed(kind, event):
+    # Build the embed for a notification as a plain dict, ready to be sent as JSON.
+    # Rendering makes no network calls, so payloads can be batched, stored or replayed.
+    template = EMBED_KINDS[kind]
+    fields = []
+    for name in template.fields:
+        value_for, inline = EMBED_FIELDS[name]
+        value = value_for(event)
+        if value is not None:
+            fields.append({'name': name, 'value': value, 'inline': inline})
+    urls = event_urls(event)
+    links = ' | '.join(f"[{name}]({urls[name]})" for name in template.links)
+    fields.append({'name': 'Links', 'value': links, 'inline': False})
+    timestamp = EMBED_TIMESTAMPS[template.timestamp](event)
+    return {
+        'title': template.title,
+        'color': template.color,
+        'fields': fields,
+        'footer': {'text': config['license_notice']},
+        'timestamp': iso_timestamp(timestamp),
+    }
+
+def render_payload(kind, event):
+    # The JSON body of a webhook message carrying one notification
+    return {
+        'username': config.get('discord_username', discordUsername),
+        'avatar_url': config.get('discord_avatar_url', discordAvatarURL),
+        'embeds': [render_embed(kind, event)],
+    }
+
+def webhook_url():
+    # The current feed's Discord webhook: the environment variable named by webhook_env, else DISCORD_WEBHOOK
+    name = config.get('webhook_env')
+    return os.environ[name] if name else DISCORD_WEBHOOK_URL
+
+class DiscordMessage:
+    # A webhook message: a JSON payload and the thread it is posted to.
+    # With message_id set it edits that message, and posts a new one if the edit fails.
+    # With record_for set (an EventID), the ID of a newly posted message is kept in posted_id
+    # so it can be saved on that event. Messages delivered from the outbox carry the outbox
+    # entries they were built from, and batched messages the keys of the events in them.
+    def __init__(self, payload, thread_id=None, url=None, entries=(), message_id=None, record_for=None):
+        self.payload = payload
+        self.thread_id = thread_id
+        self.url = url or webhook_url()
+        self.entries = list(entries)
+        self.message_id = message_id
+        self.record_for = record_for
+        self.posted_id = None
+        self.event_keys = []
+
+    @property
+    def embeds(self):
+        return self.payload.get('embeds', [])
+
+    @embeds.setter
+    def embeds(self, embeds):
+        self.payload['embeds'] = embeds
+
+    @property
+    def batchable(self):
+        # Only plain embed posts can share a message; an edit, or a post whose ID is kept, stands alone
+        return self.message_id is None and self.record_for is None and bool(self.embeds)
+
+    def execute(self):
+        params = {'thread_id': self.thread_id} if self.thread_id is not None else {}
+        if self.message_id is not None:
+            # Only the embeds can be changed on an existing message
+            response = runtime.http_session.patch(f"{self.url}/messages/{self.message_id}", json={'embeds': self.embeds},
+                                          params=params or None, timeout=HTTP_TIMEOUT)
+            if response.ok or response.status_code == 429:
+                return response
+            logging.warning(f"Editing Discord message {self.message_id} failed ({response.status_code}), posting a new message")
+            self.message_id = None
+        if self.record_for is not None:
+            # wait=true makes Discord return the created message, with its ID
+            params['wait'] = 'true'
+        response = runtime.http_session.post(self.url, json=self.payload, params=params or None, timeout=HTTP_TIMEOUT)
+        if response.ok and self.record_for is not None:
+            self.posted_id = str(response.json()['id'])
+        if not response.ok and response.status_code != 429:
+            logging.error(f"Discord webhook returned {response.status_code}: {response.text}")
+        return response
+
+def notification_id(kind, event):
+    # Idempotency key for a notification: the same change to the same event always gets the same id.
+    # The previous feed check tells occurrences apart, so a closure that clears and comes back later
+    # is announced again, while a run retried before it saved the feed cache repeats the same ids.
+    version = event.get('ContentDigest') if kind == 'updated' else event.get('StartDate')
+    return f"{event_key(event)}:{kind}:{version}:{previous_check.get() or 0}"
+
+def post_to_discord(kind, event, threadName=None):
+    # Render a notification and queue it for the event's thread. With edit_messages on, updates and
+    # clears edit the event's existing message (optionally followed by a one-line notice) and the IDs
+    # of new messages are kept on the event.
+    template = EMBED_KINDS[kind]
+    message = DiscordMessage(render_payload(kind, event), getThreadID(threadName))
+    edit_messages = config.get('edit_messages', False)
+    if edit_messages and template.edit and event.get('DiscordMessageID'):
+        message.message_id = str(event['DiscordMessageID'])
+    if edit_messages and template.track:
+        message.record_for = event_key(event)
+    send_webhook(message, event_key(event), notification_id(kind, event))
+    if message.message_id is not None and config.get('edit_notice', False):
+        notice = {
+            'username': config.get('discord_username', discordUsername),
+            'avatar_url': config.get('discord_avatar_url', discordAvatarURL),
+            'content': f"{template.title}: {event['RoadwayName']} ({event['DirectionOfTravel']})",
+        }
+        send_webhook(DiscordMessage(notice, message.thread_id), event_key(event), f"{notification_id(kind, event)}:notice")
+
+def post_to_discord_closure(event,threadName=None):
+    post_to_discord('closure', event, threadName)
+
+def post_to_discord_planned_closure(event,threadName=None):
+    # Planned/scheduled closures that have not started yet
+    post_to_discord('planned', event, threadName)
+
+def post_to_discord_closure_now_active(event,threadName=None):
+    # Post when a planned closure has now become active
+    post_to_discord('now_active', event, threadName)
+
+def post_to_discord_updated(event,threadName=None):
+    # Post that an event was updated (already previously reported)
+    post_to_discord('updated', event, threadName)
+
+def post_to_discord_completed(event,threadName=None):
+    post_to_discord('completed', event, threadName)
+
+def get_outbox():
+    # Notification outbox selected with outbox_backend in config.json; None sends notifications directly
+    backend = config.get('outbox_backend')
+    if backend is None:
+        return None
+    if backend == 'dynamodb':
+        # Every poll drains the outbox, so its pending entries must come from the index, not a scan
+        if not config.get('active_index_name'):
+            raise Exception("outbox_backend dynamodb needs active_index_name in config.json")
+        return DynamoOutbox(store.table)
+    if backend == 'sqlite':
+        return SqliteOutbox(config.get('outbox_sqlite_path', 'outbox.sqlite3'))
+    raise Exception(f"Unknown outbox_backend '{backend}' in config.json")
+
+def outbox_retry_delay(attempts):
+    # Seconds before a failed notification is tried again, doubling per attempt
+    return min(OUTBOX_BASE_DELAY * (2 ** (attempts - 1)), OUTBOX_MAX_DELAY)
+
+class Outbox:
+    # Durable queue of rendered notifications. A run records its notifications here and flushes
+    # them before its state writes; drain_outbox then delivers them. Entries are keyed by
+    # notification_id, so a change recorded twice (a run that failed before saving its state)
+    # is only delivered once. Backends implement insert, save and entries.
+    def __init__(self):
+        self.recorded = []
+        self.flushed = []
+        self.sequence = 0
+
+    def add(self, message, key, notification_id):
+        self.sequence += 1
+        self.recorded.append({
+            'id': notification_id,
+            'key': key,
+            'thread_id': message.thread_id,
+            'payload': message.payload,
+            'message_id': message.message_id,
+            'record_for': message.record_for,
+            # Orders entries across runs, then within a run
+            'sequence': runtime.utc_timestamp * 100000 + self.sequence,
+            'attempts': 0,
+            'next_attempt_at': runtime.utc_timestamp,
+            'state': 'pending',
+            'created_at': runtime.utc_timestamp,
+        })
+
+    def flush(self):
+        for entry in self.recorded:
+            if self.insert(entry):
+                self.flushed.append(entry)
+            else:
+                logging.info(f"Notification {entry['id']} is already in the outbox, not adding it again")
+        logging.info(f"Outbox: recorded {len(self.flushed)} of {len(self.recorded)} notifications")
+        self.recorded = []
+
+    def pending(self, now):
+        # Entries due for delivery, oldest first. An entry waiting out its backoff holds back the
+        # later entries for the same event. Entries flushed by this run are included even if the
+        # backend's listing does not show them yet.
+        entries = {entry['id']: entry for entry in self.flushed}
+        entries.update((entry['id'], entry) for entry in self.entries('pending'))
+        due, waiting = [], set()
+        for entry in sorted(entries.values(), key=lambda entry: entry['sequence']):
+            if entry['state'] != 'pending' or entry['key'] in waiting:
+                continue
+            if entry['next_attempt_at'] > now:
+                waiting.add(entry['key'])
+            else:
+                due.append(entry)
+        return due
+
+    def sent(self, entry):
+        entry.update(state='sent', sent_at=runtime.utc_timestamp)
+        self.save(entry)
+
+    def failed(self, entry, error):
+        entry['attempts'] += 1
+        entry['last_error'] = str(error)[:500]
+        if entry['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            entry['state'] = 'dead'
+            logging.error(f"Notification {entry['id']} failed {entry['attempts']} times, moved to dead letters: {error}")
+        else:
+            entry['next_attempt_at'] = runtime.utc_timestamp + outbox_retry_delay(entry['attempts'])
+            logging.warning(f"Notification {entry['id']} failed (attempt {entry['attempts']}), retrying later: {error}")
+        self.save(entry)
+
+    def requeue_dead(self):
+        # Give dead-lettered notifications a fresh set of attempts
+        entries = self.entries('dead')
+        for entry in entries:
+            entry.update(state='pending', attempts=0, next_attempt_at=runtime.utc_timestamp)
+            self.save(entry)
+        return len(entries)
+
+    def __enter__(self):
+        self.token = active_outbox.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        active_outbox.reset(self.token)
+
+class DynamoOutbox(Outbox):
+    # Outbox entries stored as OUTBOX_PREFIX items in the events table. Pending entries carry the
+    # sparse active index key with their own value, so with active_index_name set they are found
+    # with a query instead of a scan (get_outbox requires it; only the dead letters are scanned for).
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+
+    def insert(self, entry):
+        from botocore.exceptions import ClientError
+        try:
+            self.table.put_item(Item=self.to_item(entry), ConditionExpression='attribute_not_exists(EventID)')
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def save(self, entry):
+        self.table.put_item(Item=self.to_item(entry))
+
+    def entries(self, state):
+        index_name = config.get('active_index_name')
+        if state == 'pending' and index_name:
+            items = query_pages({
+                'IndexName': index_name,
+                'KeyConditionExpression': '#k = :k',
+                'ExpressionAttributeNames': {'#k': ACTIVE_INDEX_ATTRIBUTE},
+                'ExpressionAttributeValues': {':k': OUTBOX_INDEX_VALUE}
+            })
+        else:
+            items = scan_pages({
+                'FilterExpression': 'begins_with(EventID, :prefix) AND OutboxState = :state',
+                'ExpressionAttributeValues': {':prefix': OUTBOX_PREFIX, ':state': state},
+                'ConsistentRead': True
+            })
+        return [self.from_item(item) for item in items]
+
+    @staticmethod
+    def to_item(entry):
+        item = {
+            'EventID': OUTBOX_PREFIX + entry['id'],
+            'OutboxState': entry['state'],
+            'DeliveryKey': entry['key'],
+            'ThreadID': entry['thread_id'],
+            'MessageID': entry.get('message_id'),
+            'RecordFor': entry.get('record_for'),
+            # Stored as JSON text so the payload round-trips exactly (no floats in DynamoDB)
+            'Payload': json.dumps(entry['payload']),
+            'Sequence': entry['sequence'],
+            'Attempts': entry['attempts'],
+            'NextAttemptAt': entry['next_attempt_at'],
+            'CreatedAt': entry['created_at'],
+            'SentAt': entry.get('sent_at'),
+            'LastError': entry.get('last_error'),
+        }
+        if entry['state'] == 'pending':
+            item[ACTIVE_INDEX_ATTRIBUTE] = OUTBOX_INDEX_VALUE
+        elif entry['state'] == 'sent':
+            # Sent entries only guard against repeats for a while; dead ones stay until requeued
+            item[EXPIRY_ATTRIBUTE] = entry['sent_at'] + RETENTION_SECONDS
+        return {name: value for name, value in item.items() if value is not None}
+
+    @staticmethod
+    def from_item(item):
+        return {
+            'id': item['EventID'][len(OUTBOX_PREFIX):],
+            'key': item['DeliveryKey'],
+            'thread_id': item.get('ThreadID'),
+            'message_id': item.get('MessageID'),
+            'record_for': item.get('RecordFor'),
+            'payload': json.loads(item['Payload']),
+            'sequence': int(item['Sequence']),
+            'attempts': int(item['Attempts']),
+            'next_attempt_at': int(item['NextAttemptAt']),
+            'state': item['OutboxState'],
+            'created_at': int(item['CreatedAt']),
+            'sent_at': int(item['SentAt']) if 'SentAt' in item else None,
+            'last_error': item.get('LastError'),
+        }
+
+class SqliteOutbox(Outbox):
+    # Outbox in a local SQLite file, for development runs without DynamoDB
+    COLUMNS = ['id', 'key', 'thread_id', 'payload', 'sequence', 'attempts', 'next_attempt_at',
+               'state', 'created_at', 'sent_at', 'last_error', 'message_id', 'record_for']
+
+    def __init__(self, path):
+        super().__init__()
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outbox (id TEXT PRIMARY KEY, key TEXT, thread_id TEXT, payload TEXT, "
+            "sequence INTEGER, attempts INTEGER, next_attempt_at INTEGER, state TEXT, created_at INTEGER, "
+            "sent_at INTEGER, last_error TEXT, message_id TEXT, record_for TEXT)"
+        )
+        # Outbox files created before message editing lack its columns
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(outbox)")}
+        for column in ['message_id', 'record_for']:
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+
+    def row(self, entry):
+        return [json.dumps(entry['payload']) if column == 'payload' else entry.get(column) for column in self.COLUMNS]
+
+    def insert(self, entry):
+        with self.connection:
+            cursor = self.connection.execute(
+                f"INSERT OR IGNORE INTO outbox ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                self.row(entry)
+            )
+        return cursor.rowcount == 1
+
+    def save(self, entry):
+        with self.connection:
+            self.connection.execute(
+                f"REPLACE INTO outbox ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                self.row(entry)
+            )
+
+    def entries(self, state):
+        rows = self.connection.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM outbox WHERE state = ? ORDER BY sequence", (state,)
+        )
+        entries = [dict(zip(self.COLUMNS, row)) for row in rows]
+        for entry in entries:
+            entry['payload'] = json.loads(entry['payload'])
+        return entries
+
+def deliver_chain(messages, deadline):
+    # Send one key's messages in order, stopping at the first failure so nothing overtakes it.
+    # Returns (message, error) for every message that was tried.
+    outcomes = []
+    for message in messages:
+        if time.monotonic() >= deadline:
+            break
+        try:
+            deliver_webhook(message)
+            outcomes.append((message, None))
+        except Exception as e:
+            outcomes.append((message, e))
+            break
+    return outcomes
+
+def drain_outbox(outbox):
+    # Deliver the outbox's due notifications concurrently, one chain per event (per thread when
+    # batch_embeds packs them). No new message is started once outbox_drain_seconds is spent;
+    # whatever is left stays pending for the next run, and failures back off until they are dead-lettered.
+    update_utc_timestamp()
+    entries = outbox.pending(runtime.utc_timestamp)
+    if not entries:
+        return
+    messages = []
+    if config.get('batch_embeds', False):
+        batcher = EmbedBatcher(dispatch=lambda message, key: messages.append((key, message)))
+        candidates = [outbox_message(entry) for entry in entries]
+        # An event with an edit or tracked post in the queue keeps all its messages on its own chain
+        standalone = {message.entries[0]['key'] for message in candidates if not message.batchable}
+        for message in candidates:
+            if message.entries[0]['key'] in standalone:
+                messages.append((message.entries[0]['key'], message))
+            else:
+                batcher.add(message)
+        batcher.flush()
+    else:
+        messages = [(entry['key'], outbox_message(entry)) for entry in entries]
+    chains = {}
+    for key, message in messages:
+        chains.setdefault(key, []).append(message)
+
+    deadline = time.monotonic() + config.get('outbox_drain_seconds', 30)
+    with ThreadPoolExecutor(max_workers=config.get('discord_workers', 4)) as executor:
+        futures = [submit_in_context(executor, deliver_chain, chain, deadline) for chain in chains.values()]
+    results = [future.result() for future in futures]
+
+    delivered = failed = 0
+    message_ids = {}
+    for outcomes in results:
+        for message, error in outcomes:
+            if message.posted_id is not None:
+                message_ids[message.record_for] = message.posted_id
+            for entry in message.entries:
+                if error is None:
+                    outbox.sent(entry)
+                    delivered += 1
+                else:
+                    outbox.failed(entry, error)
+                    failed += 1
+    logging.info(f"Outbox: delivered {delivered}, failed {failed}, left {len(entries) - delivered - failed} pending")
+    if message_ids:
+        # The run's state was saved before delivery, so the new message IDs are written on their own
+        store = get_state_store()
+        record_message_ids(store, message_ids)
+        store.flush()
+
+def outbox_message(entry):
+    # Payloads are copied so batching never changes the stored entry
+    payload = dict(entry['payload'], embeds=list(entry['payload']['embeds']))
+    return DiscordMessage(payload, entry['thread_id'], entries=[entry],
+                          message_id=entry.get('message_id'), record_for=entry.get('record_for'))
@@ -0,0 +1,242 @@
+# One poll of a feed, from the conditional fetch to the saved feed cache, and the schedules
+# that run it: every feed once per Lambda invocation, or continuously in daemon mode.
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from contextlib import nullcontext
+
+from closurebot import runtime
+from closurebot.runtime import config, feed_settings, NB511_FEED, HTTP_TIMEOUT, http_stats, update_utc_timestamp
+from closurebot.fetch import Feed, take_api_token
+from closurebot.diff import process_events
+from closurebot.store import get_state_store, record_message_ids, get_feed_cache, save_feed_cache, cleanup_due, cleanup_old_events
+from closurebot.notify import DeliveryPool, EmbedBatcher, previous_check, get_outbox, drain_outbox
+
+__all__ = [
+    'PollResult', 'check_and_post_events', 'configured_feeds', 'run_feed', 'run_feeds', 'poll_feed',
+    'AdaptiveInterval', 'daemon_intervals', 'poll_feed_forever', 'run_daemon'
+]
+
+# What a poll found: whether any closure appeared, changed or went away, and when the next
+# planned closure starts (None if none is scheduled)
+PollResult = namedtuple('PollResult', ['changed', 'next_transition_at'])
+
+def check_and_post_events(outbox=None):
+    # Perform API call to the feed's 511 API (NB511 unless the feeds registry says otherwise)
+    feed_name = config.get('name', NB511_FEED['name'])
+    api_url = config.get('api_url', NB511_FEED['api_url'])
+    params = {
+        'format': 'json',
+        'lang': 'en'
+    }
+    # Feeds with an api_key_env pass the key in that environment variable; ON511 needs none
+    api_key_env = config.get('api_key_env', NB511_FEED['api_key_env'])
+    if api_key_env:
+        api_key = os.environ.get(api_key_env)
+        if not api_key:
+            raise Exception(f"{feed_name} API key is required. Set {api_key_env} environment variable.")
+        params['key'] = api_key
+    # Ask NB511 for the feed only if it changed since the last poll. Skip the conditional
+    # headers when a planned closure is due to start, since that needs a run even if nothing changed.
+    update_utc_timestamp()
+    feed_cache = get_feed_cache()
+    transition_due = feed_cache.get('NextTransitionAt') is not None and feed_cache['NextTransitionAt'] <= runtime.utc_timestamp
+    headers = {}
+    if not transition_due:
+        if feed_cache.get('ETag'):
+            headers['If-None-Match'] = feed_cache['ETag']
+        if feed_cache.get('LastModified'):
+            headers['If-Modified-Since'] = feed_cache['LastModified']
+
+    unchanged = PollResult(False, feed_cache.get('NextTransitionAt'))
+    if not take_api_token(feed_name):
+        return unchanged
+
+    # In streaming mode the body is parsed as it arrives instead of being buffered first
+    stream = config.get('stream_feed', False)
+    response = runtime.http_session.get(api_url, params=params, headers=headers, stream=stream, timeout=HTTP_TIMEOUT)
+    if response.status_code == 304:
+        logging.info(f"{feed_name} feed not modified since last poll, skipping")
+        response.close()
+        save_feed_cache(dict(feed_cache, CheckedAt=runtime.utc_timestamp))
+        return unchanged
+    if not response.ok:
+        raise Exception(f"Issue connecting to {feed_name} API")
+
+    # Parse the response once; every stage below shares the same Feed
+    try:
+        feed = Feed.from_stream(response) if stream else Feed.from_response(response)
+    finally:
+        response.close()
+
+    if not transition_due and feed.digest == feed_cache.get('ContentHash'):
+        logging.info(f"{feed_name} feed content unchanged since last poll, skipping")
+        save_feed_cache(dict(feed_cache, CheckedAt=runtime.utc_timestamp))
+        return unchanged
+
+    # The state store collects every write from this run and flushes them together at the end,
+    # while Discord messages are sent concurrently as the diff produces them (or recorded in the outbox)
+    store = get_state_store()
+    # Liveness is kept per run, not per item: the closures in the previous feed were last seen
+    # at the previous check, so a closure gone from this feed ended then
+    last_seen_at = feed_cache.get('CheckedAt')
+    seen_ids = set(feed_cache['SeenIDs']) if 'SeenIDs' in feed_cache else None
+    if outbox is not None:
+        # Notifications go to the outbox first, so a Discord outage cannot lose them or stop the run.
+        # They are written before the state changes that produced them and delivered afterwards.
+        with outbox:
+            token = previous_check.set(last_seen_at)
+            try:
+                diff = process_events(feed, store, last_seen_at, seen_ids)
+            finally:
+                previous_check.reset(token)
+                outbox.flush()
+                store.flush()
+    else:
+        pool = DeliveryPool(config.get('discord_workers', 4))
+        try:
+            with pool:
+                # With batch_embeds, notifications are packed per thread and the last partial
+                # batches go out when this block ends, before the pool drains
+                with EmbedBatcher() if config.get('batch_embeds', False) else nullcontext():
+                    diff = process_events(feed, store, last_seen_at, seen_ids)
+        finally:
+            # The pool has drained, so the IDs of the messages it posted are saved with the run's state.
+            # An event whose notification failed keeps its stored state, so the next run sends it again.
+            record_message_ids(store, pool.message_ids)
+            store.discard(pool.failed_keys)
+            store.flush()
+
+    next_transition_at = feed.next_start_after(runtime.utc_timestamp)
+    save_feed_cache({
+        'ETag': response.headers.get('ETag'),
+        'LastModified': response.headers.get('Last-Modified'),
+        'ContentHash': feed.digest,
+        'CheckedAt': runtime.utc_timestamp,
+        'SeenIDs': sorted(feed.full_closures),
+        'NextTransitionAt': next_transition_at
+    })
+    return PollResult(bool(diff.new or diff.changed or diff.gone), next_transition_at)
+
+def configured_feeds():
+    # The feeds registry from config.json; without one, the single NB511 feed. Feeds do not share
+    # a table, since event IDs, markers and outbox items are not namespaced per feed.
+    feeds = config.get('feeds') or [NB511_FEED]
+    tables = [feed.get('db_name', config.get('db_name')) for feed in feeds]
+    if len(set(tables)) < len(tables):
+        raise Exception('Each feed in config.json needs its own db_name')
+    return feeds
+
+def run_feed(feed, task):
+    # Run task with the feed's registry entry layered over config
+    token = feed_settings.set(feed)
+    try:
+        return task()
+    finally:
+        feed_settings.reset(token)
+
+def run_feeds(task):
+    # Run task for every configured feed, concurrently when there are several. Each feed is fetched,
+    # diffed and stored on its own, so one failing feed does not hold up the others; the first
+    # error is raised once every feed has finished.
+    feeds = configured_feeds()
+    if len(feeds) == 1:
+        return [run_feed(feeds[0], task)]
+    with ThreadPoolExecutor(max_workers=len(feeds)) as executor:
+        futures = [executor.submit(run_feed, feed, task) for feed in feeds]
+    errors = []
+    for feed, future in zip(feeds, futures):
+        if future.exception() is not None:
+            logging.error(f"Feed {feed.get('name')} failed: {future.exception()}")
+            errors.append(future.exception())
+    if errors:
+        raise errors[0]
+    return [future.result() for future in futures]
+
+def poll_feed():
+    # One run for the current feed: check it, deliver its notifications, then housekeeping.
+    # Returns the check's PollResult.
+    outbox = get_outbox()
+    try:
+        result = check_and_post_events(outbox)
+    finally:
+        # Deliver what this run recorded plus any retries that are due, even if the
+        # feed check failed
+        if outbox is not None:
+            drain_outbox(outbox)
+    # Housekeeping runs after the notifications are out, within its own time budget
+    if cleanup_due():
+        cleanup_old_events(config.get('cleanup_budget_seconds', 10))
+    return result
+
+class AdaptiveInterval:
+    # Poll interval of one feed in daemon mode. A poll that finds closures changing halves it, down
+    # to min_interval, so storm days are followed closely; each quiet poll stretches it by a quarter,
+    # up to max_interval.
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = self.min_interval
+
+    def update(self, changed):
+        if changed:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.25)
+        return self.interval
+
+def daemon_intervals():
+    # (min, max) poll interval for the current feed. The minimum is never shorter than the steady
+    # rate its api_rate_limit allows, so the daemon stays within the quota.
+    settings = config.get('daemon', {})
+    min_interval = settings.get('min_interval', 10)
+    limit = config.get('api_rate_limit')
+    if limit:
+        min_interval = max(min_interval, limit['seconds'] / (limit['calls'] - limit.get('burst', 1)))
+    return min_interval, settings.get('max_interval', 300)
+
+async def poll_feed_forever(feed, stop):
+    # Daemon loop for one feed: poll, then sleep for the adaptive interval, or only until the next
+    # planned closure starts if that comes first, so its "now active" message goes out on time.
+    # Polls run on a worker thread; the imports, HTTP pools, caches and rate limit bucket stay warm.
+    import asyncio
+    name = feed.get('name', NB511_FEED['name'])
+    schedule = AdaptiveInterval(*run_feed(feed, daemon_intervals))
+    next_transition_at = None
+    while not stop.is_set():
+        try:
+            result = await asyncio.to_thread(run_feed, feed, poll_feed)
+            delay = schedule.update(result.changed)
+            next_transition_at = result.next_transition_at
+        except Exception as error:
+            logging.error(f"Feed {name} poll failed: {error}")
+            delay = schedule.update(False)
+        # Wake a second after the start: the run's timestamp is truncated to whole seconds and a
+        # timer can fire slightly early, either of which would leave the transition not yet due
+        if next_transition_at is not None and float(next_transition_at) + 1 > time.time():
+            delay = min(delay, float(next_transition_at) + 1 - time.time())
+        logging.info(f"Feed {name}: next poll in {delay:.1f} s")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_daemon():
+    # Poll every configured feed on its own schedule until SIGINT or SIGTERM. State stays in
+    # DynamoDB, so the daemon and the Lambda can take over from each other; the API rate limit
+    # is kept in memory unless the daemon settings name another backend. asyncio is only imported
+    # here, since the Lambda never needs it.
+    import asyncio
+    import signal
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    backend = config.get('daemon', {}).get('api_rate_limit_backend', 'memory')
+    feeds = [dict(feed, api_rate_limit_backend=backend) for feed in configured_feeds()]
+    try:
+        await asyncio.gather(*(poll_feed_forever(feed, stop) for feed in feeds))
+    finally:
+        http_stats.log_report()
@@ -0,0 +1,165 @@
+# Settings and state shared by every part of the bot: config.json with the current feed's
+# overrides, the run's UTC timestamp and the pooled HTTP session.
+import requests
+import json
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from collections.abc import Mapping
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# utc_timestamp and http_session are rebound or replaced at run time, so they are read as
+# runtime.utc_timestamp and runtime.http_session and not exported
+__all__ = [
+    'NB511_FEED', 'feed_settings', 'FeedConfig', 'config', 'HTTP_TIMEOUT', 'HTTP_POOL_SIZE',
+    'HTTP_POOL_HOSTS', 'HttpStats', 'host_key', 'make_http_session', 'http_stats', 'update_utc_timestamp',
+    'submit_in_context'
+]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler()  # Logs to the console
+    ]
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The feed polled when config.json has no feeds registry. Feed entries override config.json's
+# top-level settings for that feed; anything they leave out falls back to these NB511 values.
+NB511_FEED = {
+    'name': 'NB511',
+    'api_url': 'https://511.gnb.ca/api/v2/get/event',
+    'api_key_env': 'NB511_API_KEY',
+    'map_url': 'https://511.gnb.ca/map#{url_type}-{id}',
+}
+
+# The feeds registry entry of the feed being processed in the current context
+feed_settings = contextvars.ContextVar('feed_settings', default={})
+
+class FeedConfig(Mapping):
+    # config.json with the current feed's registry entry layered on top. Each feed is processed
+    # in its own context (see run_feeds), so feeds running concurrently each see their own settings.
+    def __init__(self, settings):
+        self.settings = settings
+
+    def __getitem__(self, name):
+        overrides = feed_settings.get()
+        if name in overrides:
+            return overrides[name]
+        return self.settings[name]
+
+    def __iter__(self):
+        return iter(self.settings.keys() | feed_settings.get().keys())
+
+    def __len__(self):
+        return len(self.settings.keys() | feed_settings.get().keys())
+
+# Load the configuration file
+with open('config.json', 'r') as f:
+    config = FeedConfig(json.load(f))
+
+# Connect and read timeouts (seconds) for every HTTP call
+HTTP_TIMEOUT = (5, 30)
+# Keep-alive connections kept per host; enough for every Discord delivery worker
+HTTP_POOL_SIZE = 16
+# Hosts whose connection pools the session keeps: Discord plus every feed in the registry
+HTTP_POOL_HOSTS = 8
+
+class HttpStats:
+    # Per-host request count, latency and connections opened for the shared session.
+    # Connections come from the session's urllib3 pools, so a warm run that reuses its
+    # keep-alive connections shows requests without new connections.
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.connections_seen = {}
+
+    def record(self, response, *args, **kwargs):
+        # requests response hook; runs on whichever thread made the call
+        with self.lock:
+            host = self.hosts.setdefault(host_key(response.url), {'requests': 0, 'seconds': 0.0, 'slowest': 0.0})
+            seconds = response.elapsed.total_seconds()
+            host['requests'] += 1
+            host['seconds'] += seconds
+            host['slowest'] = max(host['slowest'], seconds)
+
+    def connections(self):
+        # Connections opened so far per host, over every pool of every adapter
+        counts = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    name = f"{pool.host}:{pool.port}"
+                    counts[name] = counts.get(name, 0) + pool.num_connections
+        return counts
+
+    def report(self):
+        # Stats since the last report, one entry per host
+        with self.lock:
+            hosts, self.hosts = self.hosts, {}
+        opened = self.connections()
+        stats = {}
+        for name, host in hosts.items():
+            new = max(opened.get(name, 0) - self.connections_seen.get(name, 0), 0)
+            stats[name] = {
+                'requests': host['requests'],
+                'new_connections': new,
+                'reuse_rate': max(host['requests'] - new, 0) / host['requests'],
+                'avg_ms': host['seconds'] / host['requests'] * 1000,
+                'max_ms': host['slowest'] * 1000,
+            }
+        self.connections_seen = opened
+        return stats
+
+    def log_report(self):
+        for name, host in self.report().items():
+            logging.info(
+                f"HTTP {name}: {host['requests']} requests, {host['new_connections']} new connections "
+                f"({host['reuse_rate']:.0%} reused), {host['avg_ms']:.0f} ms avg, {host['max_ms']:.0f} ms max"
+            )
+
+def host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+
+def make_http_session():
+    # One pooled session shared by the NB511 fetch and every Discord send. It lives at module
+    # level, so warm Lambda invocations reuse its keep-alive connections. Only connection errors
+    # are retried, since a webhook POST that reached Discord must not be sent twice.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+http_session = make_http_session()
+http_stats = HttpStats(http_session)
+http_session.hooks['response'].append(http_stats.record)
+
+# Rebound by update_utc_timestamp, so other modules read it as runtime.utc_timestamp
+utc_timestamp = None
+
+def update_utc_timestamp():
+    global utc_timestamp
+    utc_timestamp = int(datetime.now(timezone.utc).timestamp())
+
+# set the current UTC timestamp for use in a few places
+update_utc_timestamp()
+
+def submit_in_context(executor, fn, *args):
+    # Executor threads do not inherit context variables, so each task runs in a copy of the caller's
+    # context; otherwise config and table would fall back to the top-level feed's settings
+    return executor.submit(contextvars.copy_context().run, fn, *args)
@@ -0,0 +1,496 @@
+# DynamoDB state: the events table, the active-event lookups, the run's write buffer or
+# snapshot, the marker items and the daily cleanup.
+import json
+import time
+from decimal import Decimal
+import os
+from datetime import datetime, date
+import logging
+import random
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from closurebot import runtime
+from closurebot.runtime import config, submit_in_context
+
+# table is replaced in tests and read as store.table, so it is not exported
+__all__ = [
+    'get_dynamodb', 'get_table', 'LazyTable', 'BATCH_GET_LIMIT', 'BATCH_WRITE_LIMIT', 'BATCH_MAX_RETRIES',
+    'ACTIVE_INDEX_ATTRIBUTE', 'ACTIVE_INDEX_VALUE', 'OUTBOX_PREFIX', 'OUTBOX_INDEX_VALUE',
+    'RETENTION_SECONDS', 'EXPIRY_ATTRIBUTE', 'CLEANUP_PAGE_SIZE', 'ACTIVE_STATE_ATTRIBUTES',
+    'float_to_decimal', 'record_message_ids', 'scan_pages', 'query_pages', 'iter_active_events',
+    'backfill_active_index', 'cleanup_old_events', 'cleanup_due', 'batch_retry_delay',
+    'load_active_events', 'batch_write', 'WriteBuffer', 'get_state_store', 'RowStateStore',
+    'SnapshotStateStore', 'snapshot_json_default', 'get_feed_cache', 'save_feed_cache',
+    'get_cleanup_marker', 'update_last_execution_day'
+]
+
+AWS_ACCESS_KEY_ID = os.environ.get('AWS_DB_KEY', None)
+AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_DB_SECRET_ACCESS_KEY', None)
+
+@lru_cache(maxsize=None)
+def get_dynamodb():
+    # boto3 is imported and the resource built on first use, not when scrape is imported
+    import boto3
+    from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+    # Fallback mechanism for credentials
+    try:
+        # Use environment variables if they exist
+        if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
+            return boto3.resource(
+                'dynamodb',
+                region_name='us-east-1',
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+            )
+        # Otherwise, use IAM role permissions (default behavior of boto3)
+        return boto3.resource('dynamodb', region_name='us-east-1')
+    except (NoCredentialsError, PartialCredentialsError):
+        print("AWS credentials are not properly configured. Ensure IAM role or environment variables are set.")
+        raise
+
+@lru_cache(maxsize=None)
+def get_table(name):
+    return get_dynamodb().Table(name)
+
+class LazyTable:
+    # Module-level stand-in for the current feed's DynamoDB Table (db_name); the real one is
+    # built by get_table on first use
+    def __getattr__(self, name):
+        return getattr(get_table(config['db_name']), name)
+
+table = LazyTable()
+
+# DynamoDB accepts at most 100 keys per BatchGetItem request
+BATCH_GET_LIMIT = 100
+# DynamoDB accepts at most 25 put/delete requests per BatchWriteItem request
+BATCH_WRITE_LIMIT = 25
+# How many times to re-send unprocessed batch keys/items before giving up
+BATCH_MAX_RETRIES = 5
+
+# Sparse GSI key: only set while an event is active, so the index holds just the active events
+ACTIVE_INDEX_ATTRIBUTE = 'ActiveIndexKey'
+ACTIVE_INDEX_VALUE = 'ACTIVE'
+# Outbox items share the table; pending ones are keyed into the active index under their own value
+OUTBOX_PREFIX = 'Outbox#'
+OUTBOX_INDEX_VALUE = 'OUTBOX'
+# Inactive events and delivered outbox entries are kept this long, then DynamoDB's TTL deletes them
+RETENTION_SECONDS = 5 * 24 * 3600
+EXPIRY_ATTRIBUTE = 'ExpiresAt'
+# Items the cleanup scan reads per page; the time budget is checked between pages
+CLEANUP_PAGE_SIZE = 500
+
+# Attributes of an active item needed to diff it against the feed and to post its completion
+ACTIVE_STATE_ATTRIBUTES = [
+    'EventID', 'RoadwayName', 'DirectionOfTravel', 'Description', 'StartDate', 'PlannedEndDate',
+    'Comment', 'IsFullClosure', 'lastTouched', 'Latitude', 'Longitude', 'DetectedPolygon',
+    'wasPlannedClosure', 'ContentDigest', 'DiscordMessageID'
+]
+
+
+# Function to convert the float values in the event data to Decimal, as DynamoDB doesn't support float type
+def float_to_decimal(event):
+    for key, value in event.items():
+        if isinstance(value, float):
+            event[key] = Decimal(str(value))
+        elif isinstance(value, dict):
+            event[key] = float_to_decimal(value)
+    return event
+
+def record_message_ids(store, message_ids):
+    # Keep the Discord message posted for each event, so its updates and clear can edit it.
+    # The event may have been cleaned up since the message was queued; the ID is then dropped
+    # rather than recreating the event as an item with nothing but a message ID.
+    for event_id, message_id in message_ids.items():
+        store.update(event_id, {'DiscordMessageID': message_id}, must_exist=True)
+
+def scan_pages(scan_params):
+    # Generator yielding the items of a scan page by page, following LastEvaluatedKey
+    scan_params = dict(scan_params, TableName=table.name)
+    while True:
+        response = table.meta.client.scan(**scan_params)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def query_pages(query_params):
+    # Generator yielding the items of a query page by page, following LastEvaluatedKey
+    query_params = dict(query_params, TableName=table.name)
+    while True:
+        response = table.meta.client.query(**query_params)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def iter_active_events(segments=1, index_name=None):
+    # Stream the active items (isActive=1), fetching only ACTIVE_STATE_ATTRIBUTES.
+    # Scans use consistent reads, since this is the snapshot new events are detected against.
+    # With index_name, the sparse active-events GSI is queried so only active items are read.
+    # Otherwise the table is scanned; with segments > 1 as a DynamoDB parallel scan, one thread per segment.
+    from boto3.dynamodb.conditions import Attr, Key
+    projection = {
+        'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(ACTIVE_STATE_ATTRIBUTES))),
+        'ExpressionAttributeNames': {f"#p{i}": name for i, name in enumerate(ACTIVE_STATE_ATTRIBUTES)}
+    }
+    if index_name:
+        yield from query_pages(dict(
+            projection,
+            IndexName=index_name,
+            KeyConditionExpression=Key(ACTIVE_INDEX_ATTRIBUTE).eq(ACTIVE_INDEX_VALUE)
+        ))
+        return
+    scan_params = dict(projection, FilterExpression=Attr('isActive').eq(1), ConsistentRead=True)
+    if segments <= 1:
+        yield from scan_pages(scan_params)
+        return
+    # boto3 clients are thread-safe, so each segment scans through the shared table client
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            submit_in_context(executor, lambda segment: list(scan_pages(dict(scan_params, Segment=segment, TotalSegments=segments))), segment)
+            for segment in range(segments)
+        ]
+        for future in futures:
+            yield from future.result()
+
+def backfill_active_index():
+    # One-off migration: set the sparse index key on active items written before the index existed
+    from boto3.dynamodb.conditions import Attr
+    writes = WriteBuffer(table)
+    for item in scan_pages({
+        'FilterExpression': Attr('isActive').eq(1) & Attr(ACTIVE_INDEX_ATTRIBUTE).not_exists(),
+        'ProjectionExpression': 'EventID'
+    }):
+        writes.update(str(item['EventID']), {ACTIVE_INDEX_ATTRIBUTE: ACTIVE_INDEX_VALUE})
+    writes.flush()
+    logging.info(f"Backfilled {ACTIVE_INDEX_ATTRIBUTE} on {writes.writes_requested} active items")
+    return writes.writes_requested
+
+def cleanup_old_events(budget_seconds=None):
+    # Delete expired items that DynamoDB's TTL has not removed: items written before ExpiresAt
+    # existed, and expired ones still waiting for TTL (which can lag by a day or two).
+    # Deletes go through a batch writer. With a budget the scan stops after that many seconds
+    # and the next run resumes from where it stopped. Returns True once the whole table is done.
+    from boto3.dynamodb.conditions import Attr
+    deadline = None if budget_seconds is None else time.monotonic() + budget_seconds
+    cutoff_unix = runtime.utc_timestamp - RETENTION_SECONDS
+    scan_params = {
+        'FilterExpression': (Attr('LastUpdated').lt(cutoff_unix) & Attr('isActive').eq(0))
+        # Delivered outbox entries are only kept to stop repeats of recent notifications
+        | (Attr('OutboxState').eq('sent') & Attr('SentAt').lt(cutoff_unix))
+        | Attr(EXPIRY_ATTRIBUTE).lt(runtime.utc_timestamp),
+        'ProjectionExpression': 'EventID',
+        'Limit': CLEANUP_PAGE_SIZE
+    }
+    marker = get_cleanup_marker()
+    if marker.get('SweepStartKey'):
+        scan_params['ExclusiveStartKey'] = marker['SweepStartKey']
+    deleted = 0
+    with table.batch_writer() as batch:
+        while True:
+            response = table.scan(**scan_params)
+            for item in response['Items']:
+                batch.delete_item(Key={'EventID': str(item['EventID'])})
+                deleted += 1
+            start_key = response.get('LastEvaluatedKey')
+            if start_key is None or (deadline is not None and time.monotonic() >= deadline):
+                break
+            scan_params['ExclusiveStartKey'] = start_key
+    if start_key is None:
+        update_last_execution_day()
+    else:
+        table.put_item(Item=dict(marker, EventID='LastCleanup', SweepStartKey=start_key))
+    logging.info(f"Cleanup deleted {deleted} expired items" + ("" if start_key is None else ", resuming next run"))
+    return start_key is None
+
+def cleanup_due():
+    # The cleanup runs once a day, and on every run until an interrupted sweep finishes
+    marker = get_cleanup_marker()
+    return marker.get('LastExecutionDay') is None or marker['LastExecutionDay'] < date.today().isoformat() \
+        or 'SweepStartKey' in marker
+
+def batch_retry_delay(attempt):
+    # Exponential backoff with jitter for re-sending unprocessed batch keys/items
+    return min(0.05 * (2 ** attempt), 2.0) * random.uniform(0.5, 1.0)
+
+def load_active_events(event_ids):
+    # Fetch the stored items for the given event IDs with BatchGetItem, in chunks of BATCH_GET_LIMIT.
+    # Returns a dict of EventID -> item containing only active items (isActive=1).
+    keys = [{'EventID': event_id} for event_id in dict.fromkeys(event_ids)]
+    active_states = {}
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {
+            table.name: {
+                'Keys': keys[start:start + BATCH_GET_LIMIT],
+                'ConsistentRead': True
+            }
+        }
+        attempt = 0
+        while request_items:
+            response = table.meta.client.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(table.name, []):
+                if item.get('isActive') == 1:
+                    active_states[item['EventID']] = item
+            # DynamoDB may hand back keys it could not process (throttling or the 16 MB response cap)
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                attempt += 1
+                if attempt > BATCH_MAX_RETRIES:
+                    raise Exception(f"BatchGetItem still had unprocessed keys after {BATCH_MAX_RETRIES} retries")
+                logging.warning(f"BatchGetItem returned unprocessed keys, retrying (attempt {attempt})")
+                time.sleep(batch_retry_delay(attempt))
+    return active_states
+
+def batch_write(write_requests):
+    # Send put/delete requests with BatchWriteItem in chunks of BATCH_WRITE_LIMIT,
+    # re-sending any UnprocessedItems with backoff. Returns the number of requests sent.
+    requests_sent = 0
+    for start in range(0, len(write_requests), BATCH_WRITE_LIMIT):
+        request_items = {table.name: write_requests[start:start + BATCH_WRITE_LIMIT]}
+        attempt = 0
+        while request_items:
+            response = table.meta.client.batch_write_item(RequestItems=request_items)
+            requests_sent += 1
+            request_items = response.get('UnprocessedItems')
+            if request_items:
+                attempt += 1
+                if attempt > BATCH_MAX_RETRIES:
+                    raise Exception(f"BatchWriteItem still had unprocessed items after {BATCH_MAX_RETRIES} retries")
+                logging.warning(f"BatchWriteItem returned unprocessed items, retrying (attempt {attempt})")
+                time.sleep(batch_retry_delay(attempt))
+    return requests_sent
+
+class WriteBuffer:
+    # Write-behind buffer for the DynamoDB mutations of one run.
+    # Repeated writes to the same EventID are merged, puts are flushed with BatchWriteItem
+    # and attribute updates with one update_item per event.
+    def __init__(self, table):
+        self.table = table
+        self.puts = {}
+        self.updates = {}
+        self.removes = {}
+        self.must_exist = set()
+        self.writes_requested = 0
+        self.requests_sent = 0
+
+    def put(self, item):
+        # A put replaces the whole item, so it supersedes any update queued before it
+        self.writes_requested += 1
+        event_id = str(item['EventID'])
+        self.updates.pop(event_id, None)
+        self.removes.pop(event_id, None)
+        self.puts[event_id] = item
+
+    def update(self, event_id, attributes, remove=(), must_exist=False):
+        # Fold the update into a pending put of the same item, or merge it with earlier updates.
+        # Attributes named in remove are deleted from the item. With must_exist the update is
+        # skipped if the item is not in the table by the time it is flushed.
+        self.writes_requested += 1
+        if event_id in self.puts:
+            self.puts[event_id].update(attributes)
+            for name in remove:
+                self.puts[event_id].pop(name, None)
+            return
+        if must_exist:
+            self.must_exist.add(event_id)
+        pending_sets = self.updates.setdefault(event_id, {})
+        pending_removes = self.removes.setdefault(event_id, set())
+        pending_removes.difference_update(attributes)
+        pending_sets.update(attributes)
+        for name in remove:
+            pending_sets.pop(name, None)
+            pending_removes.add(name)
+
+    def discard(self, event_ids):
+        # Drop the pending writes of these events
+        for event_id in event_ids:
+            for pending in (self.puts, self.updates, self.removes):
+                pending.pop(event_id, None)
+            self.must_exist.discard(event_id)
+
+    @property
+    def writes_saved(self):
+        return self.writes_requested - self.requests_sent
+
+    def flush(self):
+        from botocore.exceptions import ClientError
+        if self.puts:
+            self.requests_sent += batch_write([
+                {'PutRequest': {'Item': float_to_decimal(item)}} for item in self.puts.values()
+            ])
+        for event_id, attributes in self.updates.items():
+            removes = sorted(self.removes.get(event_id, ()))
+            names = {f"#a{i}": name for i, name in enumerate(attributes)}
+            names.update({f"#r{i}": name for i, name in enumerate(removes)})
+            expression = []
+            if attributes:
+                expression.append("SET " + ", ".join(f"#a{i} = :v{i}" for i in range(len(attributes))))
+            if removes:
+                expression.append("REMOVE " + ", ".join(f"#r{i}" for i in range(len(removes))))
+            params = {
+                'Key': {'EventID': event_id},
+                'UpdateExpression': " ".join(expression),
+                'ExpressionAttributeNames': names
+            }
+            if attributes:
+                params['ExpressionAttributeValues'] = float_to_decimal(
+                    {f":v{i}": value for i, value in enumerate(attributes.values())}
+                )
+            if event_id in self.must_exist:
+                params['ConditionExpression'] = 'attribute_exists(EventID)'
+            try:
+                self.table.update_item(**params)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logging.info(f"Skipped the update of event {event_id}, which is no longer stored")
+            self.requests_sent += 1
+        if self.writes_requested:
+            logging.info(f"Flushed {self.writes_requested} writes in {self.requests_sent} requests (saved {self.writes_saved})")
+        self.puts = {}
+        self.updates = {}
+        self.removes = {}
+        self.must_exist = set()
+
+def get_state_store():
+    # State backend selected with state_backend in config.json
+    backend = config.get('state_backend', 'rows')
+    if backend == 'rows':
+        return RowStateStore(table)
+    if backend == 'snapshot':
+        return SnapshotStateStore(table)
+    raise Exception(f"Unknown state_backend '{backend}' in config.json")
+
+class RowStateStore(WriteBuffer):
+    # Default state backend: one DynamoDB item per event.
+    # State stores expose load_active/confirm_new plus the WriteBuffer put/update/discard/flush methods.
+    def load_active(self):
+        # EventID -> item for every active event
+        return {
+            item['EventID']: item
+            for item in iter_active_events(config.get('scan_segments', 1), config.get('active_index_name'))
+        }
+
+    def confirm_new(self, event_ids):
+        # Re-read events missing from load_active with a consistent read (the GSI may lag)
+        return load_active_events(event_ids)
+
+class SnapshotStateStore:
+    # Alternative state backend: the whole set of active events is kept as gzip-compressed JSON in a
+    # single item, so a run is one read and one write. The Version attribute guards against
+    # overlapping runs: a flush that loses the race reloads the snapshot and replays its changes.
+    def __init__(self, table):
+        self.table = table
+        self.version = 0
+        self.events = {}
+        self.changes = []
+        self.loaded = False
+
+    def load_active(self):
+        self.loaded = True
+        response = self.table.get_item(Key={'EventID': 'StateSnapshot'}, ConsistentRead=True)
+        item = response.get('Item')
+        if item:
+            self.version = int(item['Version'])
+            self.events = json.loads(gzip.decompress(item['Snapshot'].value))
+        else:
+            self.version = 0
+            self.events = {}
+        for change in self.changes:
+            self.apply(*change)
+        return dict(self.events)
+
+    def confirm_new(self, event_ids):
+        # The snapshot is read consistently, so there is nothing more to find
+        return {}
+
+    def put(self, item):
+        self.changes.append((str(item['EventID']), dict(item), None, ()))
+        self.apply(*self.changes[-1])
+
+    def update(self, event_id, attributes, remove=(), must_exist=False):
+        # Updates to events missing from the snapshot are always dropped (see apply)
+        self.changes.append((event_id, None, dict(attributes), tuple(remove)))
+        self.apply(*self.changes[-1])
+
+    def discard(self, event_ids):
+        # Drop the changes to these events, rebuilding the snapshot from the stored one and the rest
+        if any(change[0] in event_ids for change in self.changes):
+            self.changes = [change for change in self.changes if change[0] not in event_ids]
+            self.load_active()
+
+    def apply(self, event_id, item, attributes, remove):
+        if item is not None:
+            self.events[event_id] = item
+        elif event_id in self.events:
+            self.events[event_id].update(attributes)
+            for name in remove:
+                self.events[event_id].pop(name, None)
+        # Only active events are kept; marking one inactive drops it from the snapshot
+        if self.events.get(event_id, {}).get('isActive') == 0:
+            del self.events[event_id]
+
+    def flush(self):
+        from boto3.dynamodb.conditions import Attr
+        from botocore.exceptions import ClientError
+        if not self.changes:
+            return
+        if not self.loaded:
+            # A store that only records writes (such as the outbox drain's message IDs) reads the
+            # current snapshot first, so its conditional put expects the right version
+            self.load_active()
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            blob = gzip.compress(json.dumps(self.events, default=snapshot_json_default).encode())
+            condition = Attr('Version').eq(self.version) if self.version else Attr('EventID').not_exists()
+            try:
+                self.table.put_item(
+                    Item={'EventID': 'StateSnapshot', 'Version': self.version + 1, 'Snapshot': blob},
+                    ConditionExpression=condition
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logging.warning(f"State snapshot version {self.version} was replaced by another run, merging (attempt {attempt + 1})")
+                self.load_active()
+                continue
+            self.version += 1
+            logging.info(f"Saved state snapshot version {self.version}: {len(self.events)} active events, {len(blob)} bytes, {len(self.changes)} changes")
+            self.changes = []
+            return
+        raise Exception(f"Could not save the state snapshot after {BATCH_MAX_RETRIES + 1} attempts")
+
+def snapshot_json_default(value):
+    # Items read back from DynamoDB hold Decimals
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__} in the state snapshot")
+
+def get_feed_cache():
+    # Validators and content hash of the last processed feed, stored in a marker item like LastCleanup
+    from boto3.dynamodb.conditions import Key
+    response = table.query(
+        KeyConditionExpression=Key('EventID').eq('FeedCache'),
+        ConsistentRead=True
+    )
+    items = response.get('Items')
+    return items[0] if items else {}
+
+def save_feed_cache(feed_cache):
+    table.put_item(Item=dict(feed_cache, EventID='FeedCache'))
+
+def get_cleanup_marker():
+    # The LastCleanup marker: LastExecutionDay of the last finished cleanup, and SweepStartKey
+    # while a cleanup that ran out of time is still in progress
+    response = table.get_item(Key={'EventID': 'LastCleanup'}, ConsistentRead=True)
+    return response.get('Item', {})
+
+def update_last_execution_day():
+    today = datetime.now().date().isoformat()
+    table.put_item(
+        Item={
+            'EventID': 'LastCleanup',
+            'LastExecutionDay': today
+        }
+    )
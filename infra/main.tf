@@ -236,3 +236,79 @@ resource "aws_iam_role_policy_attachment" "github_oidc_ecr" {
   role       = aws_iam_role.github_oidc[0].name
   policy_arn = aws_iam_policy.ecr_access[0].arn
 }
+
+# DynamoDB tables holding the closure state for each environment
+# Existing tables can be brought under Terraform with:
+#   terraform import aws_dynamodb_table.prod <prod_table_name>
+#   terraform import aws_dynamodb_table.dev <dev_table_name>
+# ActiveEventsIndex is a sparse GSI: the bot sets ActiveIndexKey only while an event is active,
+# so querying it reads the active closures without touching inactive history.
+# ExpiresAt is set when an event goes inactive (and on delivered outbox entries); DynamoDB's TTL
+# deletes those items after the retention period instead of a daily scan in the bot.
+resource "aws_dynamodb_table" "prod" {
+  name         = var.prod_table_name
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "EventID"
+
+  attribute {
+    name = "EventID"
+    type = "S"
+  }
+
+  attribute {
+    name = "ActiveIndexKey"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = "ActiveEventsIndex"
+    hash_key           = "ActiveIndexKey"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["RoadwayName", "DirectionOfTravel", "Description", "StartDate", "PlannedEndDate", "Comment", "IsFullClosure", "lastTouched", "Latitude", "Longitude", "DetectedPolygon", "wasPlannedClosure", "ContentDigest", "DiscordMessageID", "OutboxState", "DeliveryKey", "ThreadID", "MessageID", "RecordFor", "Payload", "Sequence", "Attempts", "NextAttemptAt", "CreatedAt", "LastError"]
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = var.prod_table_name
+    Environment = "production"
+    Project     = local.project_name
+  }
+}
+
+resource "aws_dynamodb_table" "dev" {
+  name         = var.dev_table_name
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "EventID"
+
+  attribute {
+    name = "EventID"
+    type = "S"
+  }
+
+  attribute {
+    name = "ActiveIndexKey"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = "ActiveEventsIndex"
+    hash_key           = "ActiveIndexKey"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["RoadwayName", "DirectionOfTravel", "Description", "StartDate", "PlannedEndDate", "Comment", "IsFullClosure", "lastTouched", "Latitude", "Longitude", "DetectedPolygon", "wasPlannedClosure", "ContentDigest", "DiscordMessageID", "OutboxState", "DeliveryKey", "ThreadID", "MessageID", "RecordFor", "Payload", "Sequence", "Attempts", "NextAttemptAt", "CreatedAt", "LastError"]
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = var.dev_table_name
+    Environment = "development"
+    Project     = local.project_name
+  }
+}
@@ -35,3 +35,13 @@ output "aws_region" {
   description = "AWS region for the ECR repositories"
   value       = var.aws_region
 }
+
+output "dynamodb_prod_table" {
+  description = "Production DynamoDB table name"
+  value       = aws_dynamodb_table.prod.name
+}
+
+output "dynamodb_dev_table" {
+  description = "Development DynamoDB table name"
+  value       = aws_dynamodb_table.dev.name
+}
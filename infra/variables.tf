@@ -30,3 +30,15 @@ variable "github_oidc_provider_arn" {
   type        = string
   default     = ""
 }
+
+variable "prod_table_name" {
+  description = "Name of the production DynamoDB table (db_name in config_production.json)"
+  type        = string
+  default     = "NB511-ClosureDB"
+}
+
+variable "dev_table_name" {
+  description = "Name of the development DynamoDB table (db_name in config_develop.json)"
+  type        = string
+  default     = "NB511-ClosureDB-Dev"
+}
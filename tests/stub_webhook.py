@@ -0,0 +1,130 @@
+"""Local stand-in for a Discord webhook, used by the tests and benchmarks.
+
+Records every request it receives and can add latency and enforce a
+Discord-style rate limit (X-RateLimit-* headers, 429 with retry_after).
+Like Discord, a POST only returns the created message with ?wait=true, and
+editing a message it never created answers 404. With fail_status set, every
+request is answered with that status instead, as during a Discord outage.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class StubWebhookServer:
+    def __init__(self, latency=0.0, rate_limit=None, rate_window=1.0, fail_status=None):
+        # rate_limit: requests allowed per rate_window seconds (None = unlimited)
+        self.latency = latency
+        self.fail_status = fail_status
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = []
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.next_message_id = 1000
+        self.message_ids = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api/webhooks/1/token"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def take_rate_slot(self):
+        # Returns (allowed, remaining, reset_after) for a request arriving now
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.rate_window:
+                self.window_start = now
+                self.window_count = 0
+            reset_after = self.rate_window - (now - self.window_start)
+            if self.rate_limit is not None and self.window_count >= self.rate_limit:
+                self.rate_limited += 1
+                return False, 0, reset_after
+            self.window_count += 1
+            remaining = None if self.rate_limit is None else self.rate_limit - self.window_count
+            return True, remaining, reset_after
+
+    def record(self, method, path, body):
+        with self.lock:
+            self.next_message_id += 1
+            self.message_ids.add(str(self.next_message_id))
+            self.requests.append({
+                'method': method,
+                'path': urlsplit(path).path,
+                'query': parse_qs(urlsplit(path).query),
+                'body': body,
+                'time': time.monotonic(),
+                'message_id': str(self.next_message_id),
+            })
+            return str(self.next_message_id)
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle_message(self):
+                length = int(self.headers.get('Content-Length', 0))
+                raw = self.rfile.read(length)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                allowed, remaining, reset_after = stub.take_rate_slot()
+                if not allowed:
+                    self.reply(429, {'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False},
+                               {'Retry-After': f"{reset_after:.3f}"})
+                    return
+                if stub.fail_status is not None:
+                    self.reply(stub.fail_status, {'message': 'Internal Server Error'}, {})
+                    return
+                body = json.loads(raw) if raw else None
+                path = urlsplit(self.path).path
+                if self.command == 'PATCH' and path.rsplit('/', 1)[-1] not in stub.message_ids:
+                    self.reply(404, {'message': 'Unknown Message', 'code': 10008}, {})
+                    return
+                message_id = stub.record(self.command, self.path, body)
+                headers = {}
+                if remaining is not None:
+                    headers = {
+                        'X-RateLimit-Limit': str(stub.rate_limit),
+                        'X-RateLimit-Remaining': str(remaining),
+                        'X-RateLimit-Reset-After': f"{reset_after:.3f}",
+                    }
+                if self.command == 'POST' and parse_qs(urlsplit(self.path).query).get('wait') != ['true']:
+                    self.reply(204, None, headers)
+                    return
+                if self.command == 'PATCH':
+                    message_id = path.rsplit('/', 1)[-1]
+                self.reply(200, dict(body or {}, id=message_id), headers)
+
+            do_POST = handle_message
+            do_PATCH = handle_message
+
+            def reply(self, status, payload, headers):
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
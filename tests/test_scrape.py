@@ -7,17 +7,28 @@ from freezegun import freeze_time
 from moto import mock_aws
 import boto3
 import os
+import subprocess
+import time
+import sys
 
 # Add this before the scrape import
 os.environ['DISCORD_WEBHOOK'] = 'https://mock-discord-webhook.com/test'
 os.environ['NB511_API_KEY'] = 'test-api-key'
 
+import scrape
 from scrape import (
     check_which_polygon_point, getThreadID, unix_to_readable,
     post_to_discord_closure, post_to_discord_updated, post_to_discord_completed,
     close_recent_events, cleanup_old_events, float_to_decimal,
-    check_and_post_events, generate_geojson
+    check_and_post_events, generate_geojson, load_active_events, WriteBuffer,
+    iter_active_events, backfill_active_index, index_feed, Feed,
+    event_digest, classify_events, SnapshotStateStore, RowStateStore, DeliveryPool,
+    EmbedBatcher, render_embed, make_http_session, HttpStats, host_key,
+    SqliteOutbox, DynamoOutbox, drain_outbox, WebhookRateLimiter, update_utc_timestamp, lambda_handler,
+    region_polygons, region_classifier, classify_regions, cleanup_due
 )
+from closurebot import runtime
+from tests.stub_webhook import StubWebhookServer
 
 # Load fixture data
 @pytest.fixture
@@ -48,6 +59,8 @@ def mock_dynamodb_table():
         # Add common table operations
         mock_table.query.return_value = {'Items': []}
         mock_table.scan.return_value = {'Items': []}
+        mock_table.meta.client.batch_get_item.return_value = {'Responses': {}, 'UnprocessedKeys': {}}
+        mock_table.meta.client.batch_write_item.return_value = {'UnprocessedItems': {}}
         yield mock_table
 
 @pytest.fixture
@@ -59,6 +72,20 @@ def mock_config():
         'db_name': 'test-db'
     }
 
+# Startup Tests
+def test_import_defers_heavy_dependencies():
+    # -X importtime lists every module `import scrape` loads. The DynamoDB and geometry stacks
+    # must wait until they are first used.
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import scrape'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=dict(os.environ, AWS_DEFAULT_REGION='us-east-1'),
+        capture_output=True, text=True, check=True
+    )
+    imported = {line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    assert 'scrape' in imported
+    assert not imported & {'boto3', 'botocore', 'shapely', 'numpy'}
+
 # Polygon Tests
 # Note: All polygons are commented out for NB511, so all points return 'Other'
 @pytest.mark.parametrize("coordinates,expected_region", [
@@ -73,6 +100,48 @@ def test_check_which_polygon_point(coordinates, expected_region):
     point = Point(coordinates[0], coordinates[1])
     assert check_which_polygon_point(point) == expected_region
 
+@pytest.fixture
+def geojson_regions(tmp_path, mock_config):
+    # Two overlapping squares around Moncton and a disjoint one around Fredericton ([lon, lat] order)
+    def square(lon, lat, size):
+        return [[[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]]
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'name': 'Greater Moncton'},
+         'geometry': {'type': 'Polygon', 'coordinates': square(-65.0, 46.0, 0.3)}},
+        {'type': 'Feature', 'properties': {'name': 'South East'},
+         'geometry': {'type': 'Polygon', 'coordinates': square(-65.2, 45.8, 1.0)}},
+        {'type': 'Feature', 'properties': {'name': 'Fredericton'},
+         'geometry': {'type': 'MultiPolygon', 'coordinates': [square(-66.8, 45.9, 0.2)]}},
+    ]}
+    path = tmp_path / 'regions.geojson'
+    path.write_text(json.dumps(collection))
+    region_polygons.cache_clear()
+    region_classifier.cache_clear()
+    with patch.object(runtime.config, 'settings', dict(mock_config, regions_geojson=str(path))):
+        yield
+    region_polygons.cache_clear()
+    region_classifier.cache_clear()
+
+def test_classify_regions_from_geojson(geojson_regions):
+    from shapely.geometry import Point
+    events = {
+        1: {'Latitude': 46.09, 'Longitude': -64.78},   # in both Moncton squares; the first listed wins
+        2: {'Latitude': 45.9, 'Longitude': -64.4},     # only in South East
+        3: {'Latitude': 45.96, 'Longitude': -66.64},   # Fredericton
+        4: {'Latitude': 47.6, 'Longitude': -65.6},     # outside every region
+        5: {'Latitude': None, 'Longitude': -64.78},    # missing coordinates
+    }
+    assert classify_regions(events) == {1: 'Greater Moncton', 2: 'South East', 3: 'Fredericton', 4: 'Other', 5: 'Other'}
+    assert check_which_polygon_point(Point(46.09, -64.78)) == 'Greater Moncton'
+    # Repeated coordinates are answered from the cache
+    assert (46.09, -64.78) in region_classifier(runtime.config['regions_geojson']).cache
+
+def test_classify_skips_cache_for_missing_coordinates(geojson_regions):
+    classifier = region_classifier(runtime.config['regions_geojson'])
+    nan = float('nan')
+    assert classifier.classify([(nan, -64.78), (46.09, nan), (46.09, -64.78)]) == ['Other', 'Other', 'Greater Moncton']
+    assert list(classifier.cache) == [(46.09, -64.78)]
+
 # Thread ID Tests
 # Note: All region-specific threads are commented out for NB511, so all return catch-all
 @pytest.mark.parametrize("region,expected_thread", [
@@ -84,7 +153,7 @@ def test_check_which_polygon_point(coordinates, expected_region):
     ('Invalid', '567890'),
 ])
 def test_getThreadID(region, expected_thread, mock_config):
-    with patch('scrape.config', mock_config):
+    with patch.object(runtime.config, 'settings', mock_config):
         assert getThreadID(region) == expected_thread
 
 # Time Conversion Tests
@@ -95,33 +164,116 @@ def test_getThreadID(region, expected_thread, mock_config):
 ])
 @freeze_time("2023-01-01 12:00:00", tz_offset=0)
 def test_unix_to_readable(timestamp, expected_time, mock_config):
-    with patch('scrape.config', mock_config):
+    with patch.object(runtime.config, 'settings', mock_config):
         assert unix_to_readable(timestamp) == expected_time
 
+@pytest.mark.parametrize("language,expected_time", [
+    ('en', '2023-Jun-30 09:00 PM'),  # ADT (UTC-3 in summer)
+    ('fr', '2023-juin-30 21 h 00'),
+    ('bilingual', '2023-Jun-30 09:00 PM / 2023-juin-30 21 h 00'),
+])
+def test_unix_to_readable_language(language, expected_time, mock_config):
+    with patch.object(runtime.config, 'settings', dict(mock_config, date_language=language)):
+        assert unix_to_readable(1688169600) == expected_time
+
 # Discord Posting Tests
-@patch('scrape.DiscordWebhook')
-def test_post_to_discord_closure(mock_webhook, sample_event, mock_config):
-    with patch('scrape.config', mock_config):
-        post_to_discord_closure(sample_event, 'GTA')
-        mock_webhook.assert_called_once()
-        webhook_instance = mock_webhook.return_value
-        webhook_instance.execute.assert_called_once()
-
-@patch('scrape.DiscordWebhook')
-def test_post_to_discord_updated(mock_webhook, sample_event, mock_config):
-    with patch('scrape.config', mock_config):
-        post_to_discord_updated(sample_event, 'GTA')
-        mock_webhook.assert_called_once()
-        webhook_instance = mock_webhook.return_value
-        webhook_instance.execute.assert_called_once()
-
-@patch('scrape.DiscordWebhook')
-def test_post_to_discord_completed(mock_webhook, sample_event, mock_config):
-    with patch('scrape.config', mock_config):
-        post_to_discord_completed(sample_event, 'GTA')
-        mock_webhook.assert_called_once()
-        webhook_instance = mock_webhook.return_value
-        webhook_instance.execute.assert_called_once()
+@pytest.fixture
+def embed_snapshots():
+    with open('tests/fixtures/embed_snapshots.json', 'r') as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("kind", ['closure', 'planned', 'now_active', 'updated', 'completed'])
+def test_render_embed_matches_snapshot(kind, embed_snapshots, mock_config):
+    # Snapshots were captured from the DiscordEmbed-based posting code this renderer replaced
+    event = embed_snapshots['item'] if kind == 'completed' else embed_snapshots['event']
+    with patch.object(runtime.config, 'settings', mock_config), patch('closurebot.runtime.utc_timestamp', 1672574400):
+        assert render_embed(kind, event) == embed_snapshots['embeds'][kind]
+
+@pytest.mark.parametrize("post", [post_to_discord_closure, post_to_discord_updated, post_to_discord_completed])
+def test_post_to_discord(post, sample_event, mock_config):
+    with patch('closurebot.runtime.http_session') as mock_session, patch.object(runtime.config, 'settings', mock_config):
+        post(sample_event, 'GTA')
+        mock_session.post.assert_called_once()
+        args, kwargs = mock_session.post.call_args
+        assert args == ('https://mock-discord-webhook.com/test',)
+        assert kwargs['params'] == {'thread_id': '567890'}
+        assert kwargs['json']['username'] == 'NB511'
+        assert len(kwargs['json']['embeds']) == 1
+
+@pytest.mark.parametrize("rate_limit", [None, 2])
+def test_delivery_pool_keeps_order_per_event(rate_limit, sample_events, mock_config):
+    events = [dict(sample_events[0], ID=f"NB--{i}") for i in range(4)]
+    with StubWebhookServer(latency=0.02, rate_limit=rate_limit, rate_window=0.2) as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch.object(runtime.config, 'settings', mock_config):
+        with DeliveryPool(max_workers=4):
+            for event in events:
+                post_to_discord_closure(event)
+            for event in events:
+                post_to_discord_updated(event)
+
+    # Every message got through, 429s included, and each event's update arrived after its closure notice
+    assert len(stub.requests) == 8
+    titles_by_event = {}
+    for request in stub.requests:
+        embed = request['body']['embeds'][0]
+        links = embed['fields'][-1]['value']
+        titles_by_event.setdefault(links, []).append(embed['title'])
+    assert len(titles_by_event) == 4
+    for titles in titles_by_event.values():
+        assert titles == ['Closed', 'Closure Update']
+
+def test_delivery_pool_reraises_delivery_errors(sample_event, mock_config):
+    with patch('closurebot.runtime.http_session') as mock_session, patch.object(runtime.config, 'settings', mock_config):
+        mock_session.post.side_effect = ConnectionError('Discord unreachable')
+        with pytest.raises(ConnectionError):
+            with DeliveryPool(max_workers=2):
+                post_to_discord_closure(sample_event)
+
+def test_embed_batcher_packs_embeds_per_message(sample_events, mock_config):
+    events = [dict(sample_events[0], ID=f"NB--{i}") for i in range(23)]
+    # Two long events push a batch past 6000 characters before it reaches 10 embeds
+    events[20]['Description'] = 'x' * 3500
+    events[21]['Description'] = 'y' * 3500
+    with StubWebhookServer() as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch.object(runtime.config, 'settings', mock_config):
+        with DeliveryPool(max_workers=4), EmbedBatcher():
+            for event in events:
+                post_to_discord_closure(event)
+
+    # 23 notifications went out in 4 messages, in the order they were queued
+    assert [len(request['body']['embeds']) for request in stub.requests] == [10, 10, 1, 2]
+    infos = [field['value'] for request in stub.requests for embed in request['body']['embeds']
+             for field in embed['fields'] if field['name'] == 'Information']
+    assert infos == [event['Description'] for event in events]
+    for request in stub.requests:
+        assert request['query']['thread_id'] == [mock_config['Thread-CatchAll']]
+        assert sum(len(embed['fields'][2]['value']) for embed in request['body']['embeds']) <= 6000
+
+def test_http_session_reuses_connections_across_runs(sample_event, mock_config):
+    session = make_http_session()
+    stats = HttpStats(session)
+    session.hooks['response'].append(stats.record)
+    with StubWebhookServer() as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch('closurebot.runtime.http_session', session), \
+         patch.object(runtime.config, 'settings', mock_config):
+        for i in range(5):
+            post_to_discord_closure(sample_event)
+        first_run = stats.report()
+        # A warm invocation finds the keep-alive connection still in the pool
+        for i in range(3):
+            post_to_discord_closure(sample_event)
+        second_run = stats.report()
+
+    host = host_key(stub.url)
+    assert first_run[host]['requests'] == 5
+    assert first_run[host]['new_connections'] == 1
+    assert first_run[host]['reuse_rate'] == 0.8
+    assert second_run[host]['requests'] == 3
+    assert second_run[host]['new_connections'] == 0
+    assert second_run[host]['reuse_rate'] == 1.0
 
 # Database Operation Tests
 @mock_aws
@@ -145,7 +297,7 @@ def test_cleanup_old_events(sample_db_items):
     for item in sample_db_items:
         table.put_item(Item=item)
     
-    with patch('scrape.table', table):
+    with patch('closurebot.store.table', table):
         cleanup_old_events()
     
     # Verify old items were deleted
@@ -154,6 +306,33 @@ def test_cleanup_old_events(sample_db_items):
             response = table.get_item(Key={'EventID': item['EventID']})
             assert 'Item' not in response
 
+@mock_aws
+def test_cleanup_old_events_resumes_within_budget(sample_db_items):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    update_utc_timestamp()
+    # Expired items still waiting for TTL, next to a closure that is still retained
+    for i in range(30):
+        table.put_item(Item=dict(sample_db_items[0], EventID=str(i), isActive=0,
+                                 ExpiresAt=runtime.utc_timestamp - 60))
+    table.put_item(Item=dict(sample_db_items[0], EventID='kept', isActive=0, LastUpdated=runtime.utc_timestamp,
+                             ExpiresAt=runtime.utc_timestamp + 3600))
+
+    with patch('closurebot.store.table', table), patch('closurebot.store.CLEANUP_PAGE_SIZE', 10):
+        # A zero budget stops after one page and leaves a resume point
+        assert cleanup_old_events(budget_seconds=0) is False
+        assert cleanup_due()
+        while not cleanup_old_events(budget_seconds=0):
+            pass
+        assert not cleanup_due()
+
+    assert [item['EventID'] for item in table.scan()['Items'] if item['EventID'] != 'LastCleanup'] == ['kept']
+
 @mock_aws
 def test_close_recent_events(sample_db_items):
     # Setup mock DynamoDB
@@ -170,15 +349,244 @@ def test_close_recent_events(sample_db_items):
     active_item['isActive'] = 1
     table.put_item(Item=active_item)
 
-    # Mock API response with empty list (no active events)
-    mock_response = Mock()
-    mock_response.text = json.dumps([])  # Empty list means no current events
-
-    with patch('scrape.table', table), \
-         patch('scrape.post_to_discord_completed') as mock_post:
-        close_recent_events(mock_response)
+    with patch('closurebot.store.table', table), \
+         patch('closurebot.diff.post_to_discord_completed') as mock_post:
+        close_recent_events(Feed([]))  # Empty feed means no current events
         mock_post.assert_called_once()
 
+@mock_aws
+def test_close_recent_events_no_longer_full_closure(sample_db_items, sample_events):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.put_item(Item=dict(sample_db_items[0], EventID='1234', isActive=1))
+    table.put_item(Item=dict(sample_db_items[0], EventID='5678', isActive=1))
+
+    # NB511 returns integer IDs; one event is downgraded from a full closure, the other still is one
+    downgraded = dict(sample_events[0], ID=1234, IsFullClosure=False)
+    ongoing = dict(sample_events[0], ID=5678, IsFullClosure=True)
+
+    with patch('closurebot.store.table', table), \
+         patch('closurebot.diff.post_to_discord_completed') as mock_post:
+        close_recent_events(Feed([downgraded, ongoing]))
+
+    mock_post.assert_called_once()
+    assert mock_post.call_args.args[0]['EventID'] == '1234'
+    assert table.get_item(Key={'EventID': '5678'})['Item']['isActive'] == 1
+
+def count_dynamodb_calls(table):
+    # Record every DynamoDB API call made through the table's client
+    calls = []
+    table.meta.client.meta.events.register(
+        'before-call.dynamodb', lambda model, **kwargs: calls.append(model.name)
+    )
+    return calls
+
+@mock_aws
+@pytest.mark.parametrize("event_count,expected_batches", [
+    (10, 1),
+    (100, 1),
+    (250, 3),
+])
+def test_load_active_events_batches_lookups(event_count, expected_batches):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    with table.batch_writer() as batch:
+        for i in range(event_count):
+            batch.put_item(Item={'EventID': str(i), 'isActive': i % 2})
+
+    calls = count_dynamodb_calls(table)
+    with patch('closurebot.store.table', table):
+        states = load_active_events(str(i) for i in range(event_count))
+
+    # Only active items come back, and the round trips grow per 100 keys rather than per event
+    assert set(states) == {str(i) for i in range(event_count) if i % 2 == 1}
+    assert calls == ['BatchGetItem'] * expected_batches
+
+def test_load_active_events_retries_unprocessed_keys(mock_dynamodb_table):
+    mock_dynamodb_table.name = 'test-db'
+    mock_dynamodb_table.meta.client.batch_get_item.side_effect = [
+        {'Responses': {'test-db': [{'EventID': '1', 'isActive': 1}]},
+         'UnprocessedKeys': {'test-db': {'Keys': [{'EventID': '2'}]}}},
+        {'Responses': {'test-db': [{'EventID': '2', 'isActive': 1}]}, 'UnprocessedKeys': {}},
+    ]
+    with patch('closurebot.store.table', mock_dynamodb_table), patch('closurebot.store.time.sleep'):
+        states = load_active_events(['1', '2'])
+    assert set(states) == {'1', '2'}
+    assert mock_dynamodb_table.meta.client.batch_get_item.call_count == 2
+
+@mock_aws
+def test_write_buffer_merges_writes_per_event():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.put_item(Item={'EventID': '3', 'isActive': 1, 'lastTouched': 1})
+
+    calls = count_dynamodb_calls(table)
+    with patch('closurebot.store.table', table):
+        writes = WriteBuffer(table)
+        # Same event put twice (now active + updated) and then touched
+        writes.put({'EventID': '1', 'isActive': 1, 'Latitude': 45.5})
+        writes.put({'EventID': '1', 'isActive': 1, 'Latitude': 45.6})
+        writes.update('1', {'lastTouched': 100})
+        writes.put({'EventID': '2', 'isActive': 1})
+        writes.update('3', {'isActive': 0})
+        writes.update('3', {'lastTouched': 200})
+        writes.flush()
+
+    assert calls == ['BatchWriteItem', 'UpdateItem']
+    assert writes.writes_requested == 6
+    assert writes.writes_saved == 4
+    assert table.get_item(Key={'EventID': '1'})['Item'] == {
+        'EventID': '1', 'isActive': 1, 'Latitude': Decimal('45.6'), 'lastTouched': 100
+    }
+    assert table.get_item(Key={'EventID': '3'})['Item'] == {'EventID': '3', 'isActive': 0, 'lastTouched': 200}
+
+def test_record_message_ids_skips_missing_events(moto_table):
+    moto_table.put_item(Item={'EventID': '1', 'isActive': 1})
+    store = RowStateStore(moto_table)
+    scrape.record_message_ids(store, {'1': '555', '2': '666'})
+    store.flush()
+    assert moto_table.get_item(Key={'EventID': '1'})['Item']['DiscordMessageID'] == '555'
+    # Event 2 was cleaned up before its message ID was recorded; no orphan item is created
+    assert 'Item' not in moto_table.get_item(Key={'EventID': '2'})
+
+def test_write_buffer_retries_unprocessed_items(mock_dynamodb_table):
+    mock_dynamodb_table.name = 'test-db'
+    unprocessed = [{'PutRequest': {'Item': {'EventID': '2'}}}]
+    mock_dynamodb_table.meta.client.batch_write_item.side_effect = [
+        {'UnprocessedItems': {'test-db': unprocessed}},
+        {'UnprocessedItems': {}},
+    ]
+    with patch('closurebot.store.table', mock_dynamodb_table), patch('closurebot.store.time.sleep') as mock_sleep:
+        writes = WriteBuffer(mock_dynamodb_table)
+        writes.put({'EventID': '1'})
+        writes.put({'EventID': '2'})
+        writes.flush()
+    retry_call = mock_dynamodb_table.meta.client.batch_write_item.call_args_list[1]
+    assert retry_call.kwargs['RequestItems'] == {'test-db': unprocessed}
+    mock_sleep.assert_called_once()
+
+def test_iter_active_events_follows_pagination(mock_dynamodb_table):
+    mock_dynamodb_table.name = 'test-db'
+    mock_dynamodb_table.meta.client.scan.side_effect = [
+        {'Items': [{'EventID': '1'}], 'LastEvaluatedKey': {'EventID': '1'}},
+        {'Items': [{'EventID': '2'}]},
+    ]
+    with patch('closurebot.store.table', mock_dynamodb_table):
+        items = list(iter_active_events())
+    assert [item['EventID'] for item in items] == ['1', '2']
+    second_page = mock_dynamodb_table.meta.client.scan.call_args_list[1].kwargs
+    assert second_page['ExclusiveStartKey'] == {'EventID': '1'}
+    assert second_page['TableName'] == 'test-db'
+
+@mock_aws
+@pytest.mark.parametrize("segments", [1, 4])
+def test_iter_active_events_projects_active_items(segments, sample_db_items):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for i in range(20):
+        item = dict(sample_db_items[0], EventID=str(i), isActive=i % 2)
+        table.put_item(Item=item)
+
+    with patch('closurebot.store.table', table):
+        items = list(iter_active_events(segments))
+
+    assert sorted(int(item['EventID']) for item in items) == list(range(1, 20, 2))
+    # Only the attributes needed for the diff and the completion embed are read back
+    assert set(items[0]) == {
+        'EventID', 'RoadwayName', 'DirectionOfTravel', 'Description', 'StartDate', 'PlannedEndDate',
+        'Comment', 'IsFullClosure', 'lastTouched', 'Latitude', 'Longitude', 'DetectedPolygon'
+    }
+
+@mock_aws
+@pytest.mark.parametrize("segments", [1, 4])
+def test_iter_active_events_reads_current_feed_table(segments, sample_db_items, mock_config):
+    # Parallel scan segments run on worker threads, which must still see the feed's db_name
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    for name, event_id in [('test-db', 'M'), ('other-db', 'X')]:
+        dynamodb.create_table(
+            TableName=name,
+            KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        ).put_item(Item=dict(sample_db_items[0], EventID=event_id, isActive=1))
+
+    with patch.object(runtime.config, 'settings', mock_config):
+        items = scrape.run_feed({'name': 'Other', 'db_name': 'other-db'}, lambda: list(iter_active_events(segments)))
+
+    assert [item['EventID'] for item in items] == ['X']
+
+def create_table_with_active_index():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    return dynamodb.create_table(
+        TableName='test-db',
+        KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'EventID', 'AttributeType': 'S'},
+            {'AttributeName': 'ActiveIndexKey', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'ActiveEventsIndex',
+            'KeySchema': [{'AttributeName': 'ActiveIndexKey', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+@mock_aws
+def test_close_recent_events_queries_active_index(sample_db_items, mock_config):
+    table = create_table_with_active_index()
+    for i in range(5):
+        table.put_item(Item=dict(sample_db_items[0], EventID=str(i), isActive=1, ActiveIndexKey='ACTIVE'))
+    # Inactive history stays out of the sparse index
+    for i in range(5, 50):
+        table.put_item(Item=dict(sample_db_items[0], EventID=str(i), isActive=0))
+
+    calls = count_dynamodb_calls(table)
+    with patch('closurebot.store.table', table), \
+         patch.object(runtime.config, 'settings', dict(mock_config, active_index_name='ActiveEventsIndex')), \
+         patch('closurebot.diff.post_to_discord_completed') as mock_post:
+        close_recent_events(Feed([]))
+
+    assert mock_post.call_count == 5
+    assert 'Scan' not in calls and calls.count('Query') == 1
+    item = table.get_item(Key={'EventID': '0'})['Item']
+    assert item['isActive'] == 0
+    assert item['ExpiresAt'] == runtime.utc_timestamp + scrape.RETENTION_SECONDS
+    assert 'ActiveIndexKey' not in item
+
+@mock_aws
+def test_backfill_active_index(sample_db_items):
+    table = create_table_with_active_index()
+    for i in range(4):
+        table.put_item(Item=dict(sample_db_items[0], EventID=str(i), isActive=i % 2))
+
+    with patch('closurebot.store.table', table):
+        assert backfill_active_index() == 2
+        indexed = list(iter_active_events(index_name='ActiveEventsIndex'))
+
+    assert sorted(item['EventID'] for item in indexed) == ['1', '3']
+    assert 'ActiveIndexKey' not in table.get_item(Key={'EventID': '0'})['Item']
+
 # Utility Function Tests
 def test_float_to_decimal(sample_event):
     result = float_to_decimal(sample_event)
@@ -192,28 +600,590 @@ def test_float_to_decimal(sample_event):
                 if isinstance(nested_value, float):
                     assert isinstance(result[key][nested_key], Decimal)
 
+def test_index_feed_normalizes_ids(sample_events):
+    feed = [dict(sample_events[0], ID=42), dict(sample_events[1], ID='MTO--7')]
+    feed_by_id = index_feed(feed)
+    assert list(feed_by_id) == ['42', 'MTO--7']
+    assert feed_by_id['42'] is feed[0]
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_feed_from_response(use_orjson, sample_events):
+    orjson = pytest.importorskip('orjson') if use_orjson else None
+    sample_events[1]['IsFullClosure'] = True
+    response = Mock()
+    response.content = json.dumps(sample_events).encode()
+    with patch('closurebot.fetch.orjson', orjson):
+        feed = Feed.from_response(response)
+    assert feed.raw == response.content
+    assert feed.events == sample_events
+    assert list(feed.full_closures) == [str(sample_events[1]['ID'])]
+    # Numbers stay as parsed; Decimal conversion happens only when an item is written
+    assert isinstance(feed.events[0]['Latitude'], float)
+
+def test_feed_from_stream_keeps_only_full_closures(sample_events):
+    pytest.importorskip('ijson')
+    import io
+    sample_events[2]['IsFullClosure'] = True
+    response = Mock()
+    response.raw = io.BytesIO(json.dumps(sample_events).encode())
+    feed = Feed.from_stream(response)
+    assert feed.raw is None
+    assert feed.events == [sample_events[2]]
+    assert list(feed.full_closures) == [str(sample_events[2]['ID'])]
+    assert isinstance(feed.events[0]['Latitude'], float)
+
+def test_feed_from_stream_without_ijson(sample_events):
+    response = Mock()
+    response.content = json.dumps(sample_events).encode()
+    with patch('closurebot.fetch.ijson', None):
+        feed = Feed.from_stream(response)
+    assert feed.events == sample_events
+
+def test_classify_events():
+    previous = {'1': 'a', '2': 'b', '3': 'c'}
+    current = {'2': 'b', '3': 'changed', '4': 'd'}
+    diff = classify_events(current, previous)
+    assert diff.new == {'4'}
+    assert diff.changed == {'3'}
+    assert diff.unchanged == {'2'}
+    assert diff.gone == {'1'}
+
+def test_event_digest_matches_stored_item(sample_events):
+    event = dict(sample_events[0], PlannedEndDate=None, Comment='Detour via Route 2')
+    # The same event as read back from DynamoDB, with numbers as Decimal
+    stored = float_to_decimal(dict(event, StartDate=float(event['StartDate']), isActive=1, lastTouched=5))
+    stored['StartDate'] = Decimal(str(stored['StartDate']))
+    assert event_digest(stored) == event_digest(event)
+    # Fields outside the embeds do not affect the digest, embed fields do
+    assert event_digest(dict(event, LastUpdated=1, LinkId='x')) == event_digest(event)
+    assert event_digest(dict(event, Comment='Detour via Route 3')) != event_digest(event)
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_updated')
+@patch('closurebot.diff.post_to_discord_closure')
+def test_check_and_post_events_updates_only_on_embed_changes(mock_closure, mock_updated, mock_get, moto_table, sample_events, mock_config):
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    calls = count_dynamodb_calls(moto_table)
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', mock_config):
+        mock_get.return_value = mock_feed_response([event])
+        check_and_post_events()
+        # NB511 bumps LastUpdated without changing anything shown in the embeds
+        mock_get.return_value = mock_feed_response([dict(event, LastUpdated=event['LastUpdated'] + 60)])
+        del calls[:]
+        check_and_post_events()
+        mock_updated.assert_not_called()
+        assert 'BatchWriteItem' not in calls and 'BatchGetItem' not in calls and 'UpdateItem' not in calls
+        # The description changes
+        mock_get.return_value = mock_feed_response([dict(event, Description='Bridge washed out')])
+        check_and_post_events()
+
+    mock_closure.assert_called_once()
+    mock_updated.assert_called_once()
+    stored = moto_table.get_item(Key={'EventID': str(event['ID'])})['Item']
+    assert stored['Description'] == 'Bridge washed out'
+    assert stored['ContentDigest'] == event_digest(dict(event, Description='Bridge washed out'))
+
+@pytest.mark.parametrize("batch_embeds", [False, True])
+def test_failed_delivery_keeps_event_for_next_run(batch_embeds, moto_table, sample_events, mock_config):
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    with patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', dict(mock_config, batch_embeds=batch_embeds)), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch('closurebot.runtime.http_session') as mock_session:
+        mock_session.get.return_value = mock_feed_response([event])
+        mock_session.post.side_effect = ConnectionError('Discord unreachable')
+        with pytest.raises(ConnectionError):
+            check_and_post_events()
+        # The closure was not announced, so it is not stored as notified
+        assert 'Item' not in moto_table.get_item(Key={'EventID': event['ID']})
+
+        mock_session.post.side_effect = None
+        mock_session.post.return_value = ok_response()
+        check_and_post_events()
+
+    assert mock_session.post.call_count == 2
+    assert mock_session.post.call_args.kwargs['json']['embeds'][0]['title'] == 'Closed'
+    assert moto_table.get_item(Key={'EventID': event['ID']})['Item']['isActive'] == 1
+
+def test_discord_error_reply_keeps_event_for_next_run(moto_table, sample_events, mock_config):
+    # A 5xx from Discord is a failed delivery, not a sent notification
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    with StubWebhookServer(fail_status=500) as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', mock_config), \
+         patch('closurebot.runtime.http_session.get') as mock_get:
+        mock_get.return_value = mock_feed_response([event])
+        with pytest.raises(Exception, match='returned 500'):
+            check_and_post_events()
+
+    assert 'Item' not in moto_table.get_item(Key={'EventID': event['ID']})
+    assert moto_table.get_item(Key={'EventID': 'FeedCache'}).get('Item') is None
+
 # Main Function Test
-@patch('scrape.requests.get')
-@patch('scrape.post_to_discord_closure')
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_closure')
 def test_check_and_post_events(mock_post, mock_get, mock_dynamodb_table, sample_events, mock_config):
     # Modify sample event to ensure it triggers a post
     sample_events[0]['IsFullClosure'] = True
     
     # Mock API response
     mock_get.return_value.ok = True
-    mock_get.return_value.text = json.dumps(sample_events)
+    mock_get.return_value.content = json.dumps(sample_events).encode()
     
-    # Mock the database query to return no existing items
-    mock_dynamodb_table.query.return_value = {'Items': []}
+    # Mock the batched state lookup to return no existing items
+    mock_dynamodb_table.meta.client.batch_get_item.return_value = {'Responses': {}, 'UnprocessedKeys': {}}
     
-    with patch('scrape.table', mock_dynamodb_table), \
-         patch('scrape.config', mock_config):
+    with patch('closurebot.store.table', mock_dynamodb_table), \
+         patch.object(runtime.config, 'settings', mock_config):
         # Test the main function
         check_and_post_events()
         
         # Verify Discord post was called for new events
         assert mock_post.call_count > 0
 
+@pytest.fixture
+def moto_table():
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        yield dynamodb.create_table(
+            TableName='test-db',
+            KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+def mock_feed_response(events, status_code=200, headers=None):
+    response = Mock()
+    response.ok = status_code < 400
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.content = json.dumps(events).encode()
+    return response
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_closure')
+def test_check_and_post_events_skips_unchanged_feed(mock_post, mock_get, moto_table, sample_events, mock_config):
+    sample_events[0]['IsFullClosure'] = True
+    sample_events[0]['StartDate'] = 1600000000
+    mock_get.return_value = mock_feed_response(sample_events, headers={'ETag': '"v1"'})
+
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', mock_config):
+        check_and_post_events()
+        # Same body again: nothing past the hash check runs
+        with patch('closurebot.poll.process_events') as mock_process:
+            check_and_post_events()
+            mock_process.assert_not_called()
+        # NB511 answers the conditional request with 304
+        mock_get.return_value = mock_feed_response([], status_code=304)
+        with patch('closurebot.poll.process_events') as mock_process:
+            check_and_post_events()
+            mock_process.assert_not_called()
+
+    mock_post.assert_called_once()
+    assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': '"v1"'}
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_closure_now_active')
+@patch('closurebot.diff.post_to_discord_planned_closure')
+def test_check_and_post_events_runs_when_planned_closure_starts(mock_planned, mock_active, mock_get, moto_table, sample_events, mock_config):
+    sample_events[0]['IsFullClosure'] = True
+    sample_events[0]['StartDate'] = 1672574400  # 2023-01-01 12:00 UTC
+    mock_get.return_value = mock_feed_response(sample_events, headers={'ETag': '"v1"'})
+
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', mock_config):
+        with freeze_time("2023-01-01 08:00:00"):
+            check_and_post_events()
+        # The feed is unchanged, but the planned closure has started since the last run
+        with freeze_time("2023-01-01 12:05:00"):
+            check_and_post_events()
+
+    mock_planned.assert_called_once()
+    mock_active.assert_called_once()
+    assert 'If-None-Match' not in mock_get.call_args.kwargs['headers']
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_completed')
+@patch('closurebot.diff.post_to_discord_updated')
+@patch('closurebot.diff.post_to_discord_closure')
+def test_cleared_time_comes_from_run_marker(mock_closure, mock_updated, mock_completed, mock_get, moto_table, sample_events, mock_config):
+    first = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    second = dict(sample_events[1], IsFullClosure=True, StartDate=1600000000)
+    calls = count_dynamodb_calls(moto_table)
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', mock_config):
+        mock_get.return_value = mock_feed_response([first, second])
+        with freeze_time("2023-01-01 12:00:00"):
+            check_and_post_events()
+        # An hour of polls: the second closure changes, nothing is written for the first
+        mock_get.return_value = mock_feed_response([first, dict(second, Description='Detour in place')])
+        del calls[:]
+        with freeze_time("2023-01-01 12:30:00"):
+            check_and_post_events()
+        with freeze_time("2023-01-01 13:00:00"):
+            check_and_post_events()
+        assert 'UpdateItem' not in calls and calls.count('BatchWriteItem') == 1
+        # The first closure is gone; it was last seen by the 13:00 run
+        mock_get.return_value = mock_feed_response([dict(second, Description='Detour in place')])
+        with freeze_time("2023-01-01 13:05:00"):
+            check_and_post_events()
+
+    mock_completed.assert_called_once()
+    cleared = mock_completed.call_args.args[0]
+    assert cleared['EventID'] == str(first['ID'])
+    assert cleared['lastTouched'] == 1672578000  # 2023-01-01 13:00 UTC
+    feed_cache = moto_table.get_item(Key={'EventID': 'FeedCache'})['Item']
+    assert feed_cache['SeenIDs'] == [str(second['ID'])]
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_completed')
+@patch('closurebot.diff.post_to_discord_closure')
+def test_check_and_post_events_snapshot_backend(mock_closure, mock_completed, mock_get, moto_table, sample_events, mock_config):
+    first = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    second = dict(sample_events[1], IsFullClosure=True, StartDate=1600000000)
+    calls = count_dynamodb_calls(moto_table)
+    with patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', dict(mock_config, state_backend='snapshot')):
+        mock_get.return_value = mock_feed_response([first, second])
+        check_and_post_events()
+        mock_get.return_value = mock_feed_response([second])
+        del calls[:]
+        check_and_post_events()
+
+    # Feed cache query, then one snapshot read, one snapshot write and the feed cache write
+    assert calls == ['Query', 'GetItem', 'PutItem', 'PutItem']
+
+    assert mock_closure.call_count == 2
+    mock_completed.assert_called_once()
+    assert mock_completed.call_args.args[0]['EventID'] == str(first['ID'])
+    snapshot = moto_table.get_item(Key={'EventID': 'StateSnapshot'})['Item']
+    assert snapshot['Version'] == 2
+    # No per-event rows are written
+    assert 'Item' not in moto_table.get_item(Key={'EventID': str(second['ID'])})
+
+def test_snapshot_state_store_merges_concurrent_runs(moto_table):
+    run_a, run_b = SnapshotStateStore(moto_table), SnapshotStateStore(moto_table)
+    run_a.load_active()
+    run_b.load_active()
+    run_a.put({'EventID': '1', 'isActive': 1, 'Latitude': 45.1})
+    run_a.flush()
+    # run_b started from the same version; its flush loses the race, reloads and replays its change
+    run_b.put({'EventID': '2', 'isActive': 1})
+    run_b.flush()
+
+    store = SnapshotStateStore(moto_table)
+    assert set(store.load_active()) == {'1', '2'}
+    assert store.version == 2
+    store.update('1', {'isActive': 0})
+    store.flush()
+    assert set(SnapshotStateStore(moto_table).load_active()) == {'2'}
+
+def test_snapshot_state_store_flushes_without_load(moto_table, caplog):
+    # The outbox drain records message IDs on a store it never loaded
+    store = SnapshotStateStore(moto_table)
+    store.load_active()
+    store.put({'EventID': '1', 'isActive': 1})
+    store.flush()
+
+    calls = count_dynamodb_calls(moto_table)
+    store = SnapshotStateStore(moto_table)
+    scrape.record_message_ids(store, {'1': '555'})
+    store.flush()
+    assert calls == ['GetItem', 'PutItem']
+    assert 'replaced by another run' not in caplog.text
+    assert SnapshotStateStore(moto_table).load_active()['1']['DiscordMessageID'] == '555'
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def make_outbox(request, moto_table, tmp_path):
+    # Each call opens the outbox afresh, the way a new Lambda invocation would
+    def make():
+        if request.param == 'sqlite':
+            return SqliteOutbox(str(tmp_path / 'outbox.sqlite3'))
+        return DynamoOutbox(moto_table)
+    with patch('closurebot.store.table', moto_table), patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()):
+        yield make
+
+def ok_response():
+    return Mock(ok=True, status_code=200, headers={})
+
+def test_outbox_delivers_each_notification_once(make_outbox, sample_events, mock_config):
+    first, second = [dict(event, IsFullClosure=True) for event in sample_events[:2]]
+    with patch.object(runtime.config, 'settings', mock_config), patch('closurebot.runtime.http_session') as mock_session:
+        mock_session.post.return_value = ok_response()
+        outbox = make_outbox()
+        with outbox:
+            post_to_discord_closure(first)
+            post_to_discord_closure(second)
+            post_to_discord_closure(first)
+        outbox.flush()
+        drain_outbox(outbox)
+        assert mock_session.post.call_count == 2
+
+        # A run that records the same change again (its state write never landed) sends nothing new
+        outbox = make_outbox()
+        with outbox:
+            post_to_discord_closure(first)
+        outbox.flush()
+        drain_outbox(outbox)
+        assert mock_session.post.call_count == 2
+
+def test_outbox_backs_off_and_dead_letters(make_outbox, sample_events, mock_config):
+    closure = dict(sample_events[0], IsFullClosure=True)
+    update = dict(closure, ContentDigest='v2')
+    with freeze_time('2024-01-01 12:00:00') as frozen, \
+         patch.object(runtime.config, 'settings', mock_config), \
+         patch('closurebot.notify.OUTBOX_MAX_ATTEMPTS', 2), \
+         patch('closurebot.runtime.http_session') as mock_session:
+        mock_session.post.side_effect = ConnectionError('Discord unreachable')
+        update_utc_timestamp()
+        outbox = make_outbox()
+        with outbox:
+            post_to_discord_closure(closure)
+            post_to_discord_updated(update)
+        outbox.flush()
+        drain_outbox(outbox)
+        # The update waits behind the failed closure notice instead of overtaking it
+        assert mock_session.post.call_count == 1
+
+        # Nothing is due until the backoff has passed
+        drain_outbox(make_outbox())
+        assert mock_session.post.call_count == 1
+        frozen.tick(61)
+        drain_outbox(make_outbox())
+        assert mock_session.post.call_count == 2
+        dead = make_outbox().entries('dead')
+        assert [entry['id'] for entry in dead] == [f"{closure['ID']}:closure:{closure['StartDate']}:0"]
+        assert dead[0]['last_error'] == 'Discord unreachable'
+
+        # Once Discord is back, requeued dead letters go out ahead of the update that waited for them
+        mock_session.post.side_effect = None
+        mock_session.post.return_value = ok_response()
+        outbox = make_outbox()
+        assert outbox.requeue_dead() == 1
+        drain_outbox(outbox)
+        titles = [call.kwargs['json']['embeds'][0]['title'] for call in mock_session.post.call_args_list[2:]]
+        assert titles == ['Closed', 'Closure Update']
+        assert make_outbox().entries('pending') == []
+
+@patch('closurebot.notify.send_webhook')
+@patch('closurebot.runtime.http_session.get')
+def test_run_feeds_polls_each_feed_independently(mock_get, mock_send, sample_events, mock_config, monkeypatch):
+    monkeypatch.setenv('ON511_WEBHOOK', 'https://discord.example/api/webhooks/2/on511')
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    feeds = [
+        {'name': 'ON511', 'api_url': 'https://511on.ca/api/v2/get/event', 'api_key_env': None,
+         'map_url': 'https://511on.ca/map#{url_type}-{id}', 'webhook_env': 'ON511_WEBHOOK', 'db_name': 'on511-db'},
+        {'name': 'NB511', 'db_name': 'nb511-db'},
+        {'name': 'Broken', 'api_url': 'https://broken.example/api/v2/get/event', 'api_key_env': None, 'db_name': 'broken-db'},
+    ]
+    mock_get.side_effect = lambda url, **kwargs: mock_feed_response([] if 'broken' in url else [event],
+                                                                    status_code=500 if 'broken' in url else 200)
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        for name in ['on511-db', 'nb511-db', 'broken-db']:
+            dynamodb.create_table(
+                TableName=name,
+                KeySchema=[{'AttributeName': 'EventID', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'EventID', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+        with patch.object(runtime.config, 'settings', dict(mock_config, feeds=feeds)):
+            # The broken feed fails the run, but only after the other feeds have finished
+            with pytest.raises(Exception, match='Issue connecting to Broken API'):
+                scrape.run_feeds(check_and_post_events)
+        for name in ['on511-db', 'nb511-db']:
+            assert dynamodb.Table(name).get_item(Key={'EventID': str(event['ID'])})['Item']['isActive'] == 1
+
+    # Each feed posts to its own webhook, with links to its own map; only NB511 is sent an API key
+    links = {call.args[0].url: call.args[0].payload['embeds'][0]['fields'][-1]['value'] for call in mock_send.call_args_list}
+    assert set(links) == {'https://discord.example/api/webhooks/2/on511', os.environ['DISCORD_WEBHOOK']}
+    assert 'https://511on.ca/map#' in links['https://discord.example/api/webhooks/2/on511']
+    assert 'https://511.gnb.ca/map#' in links[os.environ['DISCORD_WEBHOOK']]
+    keys = {call.args[0]: call.kwargs['params'].get('key') for call in mock_get.call_args_list}
+    assert keys == {'https://511on.ca/api/v2/get/event': None, 'https://511.gnb.ca/api/v2/get/event': 'test-api-key',
+                    'https://broken.example/api/v2/get/event': None}
+
+@pytest.mark.parametrize("backend", ['memory', 'dynamodb'])
+def test_api_rate_limit_holds_quota(backend, moto_table, mock_config):
+    settings = dict(mock_config, api_rate_limit={'calls': 10, 'seconds': 60}, api_rate_limit_backend=backend)
+    calls = []
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', settings), \
+         patch('closurebot.fetch.memory_token_buckets', {}), freeze_time("2023-01-01 12:00:00") as frozen:
+        # One attempt a second for two minutes; with the dynamodb backend each attempt is a new bucket
+        # on the shared item, as separate invocations would be
+        for second in range(120):
+            if scrape.api_rate_limiter().take() == 0:
+                calls.append(second)
+            frozen.tick(1)
+
+    assert calls[0] == 0
+    assert max(sum(1 for call in calls if start <= call < start + 60) for start in range(60)) <= 10
+    assert len(calls) >= 17
+
+@patch('closurebot.runtime.http_session.get')
+@patch('closurebot.diff.post_to_discord_closure')
+def test_check_and_post_events_skips_when_rate_limited(mock_post, mock_get, moto_table, sample_events, mock_config):
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    mock_get.return_value = mock_feed_response([event])
+    settings = dict(mock_config, api_rate_limit={'calls': 10, 'seconds': 60}, api_rate_limit_policy='skip')
+    with patch('closurebot.store.table', moto_table), patch.object(runtime.config, 'settings', settings):
+        check_and_post_events()
+        # A second run right away finds the bucket empty and skips without calling the API
+        check_and_post_events()
+
+    assert mock_get.call_count == 1
+    mock_post.assert_called_once()
+
+def test_adaptive_interval_follows_feed_activity():
+    schedule = scrape.AdaptiveInterval(10, 300)
+    quiet = [schedule.update(False) for _ in range(30)]
+    assert quiet[0] == 12.5 and quiet[-1] == 300
+    # A storm: each poll with changes halves the interval, down to the minimum
+    assert [schedule.update(True) for _ in range(6)] == [150, 75, 37.5, 18.75, 10, 10]
+
+def test_daemon_intervals_stay_within_quota(mock_config):
+    with patch.object(runtime.config, 'settings', dict(mock_config, daemon={'min_interval': 2, 'max_interval': 120},
+                                     api_rate_limit={'calls': 10, 'seconds': 60})):
+        min_interval, max_interval = scrape.daemon_intervals()
+    # 9 calls a minute after the one-call burst
+    assert min_interval == pytest.approx(60 / 9) and max_interval == 120
+
+def test_daemon_polls_when_planned_closure_starts(mock_config):
+    import asyncio
+    polls = []
+
+    async def run():
+        stop = asyncio.Event()
+
+        def poll():
+            polls.append(time.monotonic())
+            if len(polls) == 2:
+                stop.set()
+            # Quiet feed, but a planned closure starts in 0.3 s
+            return scrape.PollResult(False, time.time() + 0.3)
+
+        with patch('closurebot.poll.poll_feed', poll):
+            await asyncio.wait_for(scrape.poll_feed_forever({'name': 'NB511'}, stop), timeout=5)
+
+    with patch.object(runtime.config, 'settings', dict(mock_config, daemon={'min_interval': 30, 'max_interval': 60})):
+        asyncio.run(run())
+
+    assert len(polls) == 2
+    assert 0.2 < polls[1] - polls[0] < 2
+
+def test_daemon_wakes_after_planned_closure_start(mock_config):
+    # A wake that fires a few milliseconds early must still be in StartDate's second
+    import asyncio
+    delays = []
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def wait_for(awaitable, timeout):
+            delays.append(timeout)
+            awaitable.close()
+            stop.set()
+            raise asyncio.TimeoutError
+
+        with patch('closurebot.poll.poll_feed', lambda: scrape.PollResult(False, 1001)), \
+             patch('closurebot.poll.time', Mock(time=lambda: 1000.4)), \
+             patch('asyncio.wait_for', wait_for):
+            await scrape.poll_feed_forever({'name': 'NB511'}, stop)
+
+    with patch.object(runtime.config, 'settings', dict(mock_config, daemon={'min_interval': 30, 'max_interval': 60})):
+        asyncio.run(run())
+
+    assert len(delays) == 1
+    assert int(1000.4 + delays[0] - 0.01) >= 1001
+
+@mock_aws
+def test_lambda_handler_delivers_through_outbox(sample_events, mock_config):
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    moto_table = create_table_with_active_index()
+    calls = count_dynamodb_calls(moto_table)
+    with patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', dict(mock_config, outbox_backend='dynamodb', active_index_name='ActiveEventsIndex')), \
+         patch('closurebot.poll.cleanup_due', return_value=False), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch('closurebot.runtime.http_session') as mock_session:
+        mock_session.get.return_value = mock_feed_response([event])
+        mock_session.post.return_value = ok_response()
+        lambda_handler({}, None)
+
+    mock_session.post.assert_called_once()
+    item = moto_table.get_item(Key={'EventID': f"Outbox#{event['ID']}:closure:1600000000:0"})['Item']
+    assert item['OutboxState'] == 'sent'
+    assert 'ActiveIndexKey' not in item
+    assert moto_table.get_item(Key={'EventID': str(event['ID'])})['Item']['isActive'] == 1
+    # Pending notifications were looked up in the index, not with a full-table scan
+    assert 'Scan' not in calls
+
+def test_dynamodb_outbox_needs_active_index(mock_config):
+    with patch.object(runtime.config, 'settings', dict(mock_config, outbox_backend='dynamodb')):
+        with pytest.raises(Exception, match='active_index_name'):
+            scrape.get_outbox()
+
+def test_outbox_announces_each_occurrence_of_a_closure(moto_table, sample_events, mock_config):
+    # A closure that clears and later comes back with the same ID and start date is new again
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    with freeze_time('2024-01-01 12:00:00') as frozen, \
+         patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', mock_config), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch('closurebot.runtime.http_session') as mock_session:
+        mock_session.post.return_value = ok_response()
+        for events in [[event], [], [event], []]:
+            mock_session.get.return_value = mock_feed_response(events)
+            outbox = DynamoOutbox(moto_table)
+            check_and_post_events(outbox)
+            drain_outbox(outbox)
+            frozen.tick(300)
+
+    titles = [call.kwargs['json']['embeds'][0]['title'] for call in mock_session.post.call_args_list]
+    assert titles == ['Closed', 'Cleared', 'Closed', 'Cleared']
+
+@patch('closurebot.runtime.http_session.get')
+def test_edit_messages_updates_closure_in_place(mock_get, moto_table, sample_events, mock_config):
+    event = dict(sample_events[0], IsFullClosure=True, StartDate=1600000000)
+    with StubWebhookServer() as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch('closurebot.store.table', moto_table), \
+         patch.object(runtime.config, 'settings', dict(mock_config, edit_messages=True)):
+        mock_get.return_value = mock_feed_response([event])
+        check_and_post_events()
+        message_id = moto_table.get_item(Key={'EventID': event['ID']})['Item']['DiscordMessageID']
+        mock_get.return_value = mock_feed_response([dict(event, Description='Bridge washed out')])
+        check_and_post_events()
+        mock_get.return_value = mock_feed_response([])
+        check_and_post_events()
+
+    # One message for the closure, edited for the update and again when it cleared
+    assert [request['method'] for request in stub.requests] == ['POST', 'PATCH', 'PATCH']
+    assert stub.requests[0]['message_id'] == message_id
+    assert stub.requests[0]['query']['wait'] == ['true']
+    assert stub.requests[1]['path'] == stub.requests[2]['path'] == f"/api/webhooks/1/token/messages/{message_id}"
+    assert [request['body']['embeds'][0]['title'] for request in stub.requests] == ['Closed', 'Closure Update', 'Cleared']
+    item = moto_table.get_item(Key={'EventID': event['ID']})['Item']
+    assert item['isActive'] == 0
+    assert item['DiscordMessageID'] == message_id
+
+def test_edit_falls_back_to_new_message(sample_event, mock_config):
+    event = dict(sample_event, EventID=sample_event['ID'], DiscordMessageID='999', ContentDigest='v2')
+    with StubWebhookServer() as stub, \
+         patch('closurebot.notify.DISCORD_WEBHOOK_URL', stub.url), \
+         patch('closurebot.notify.webhook_rate_limiter', WebhookRateLimiter()), \
+         patch.object(runtime.config, 'settings', dict(mock_config, edit_messages=True, edit_notice=True)):
+        with DeliveryPool(max_workers=2) as pool:
+            post_to_discord_updated(event)
+
+    # The message is gone, so the update is posted afresh and becomes the one later edits go to.
+    # The notice follows the update it announces.
+    assert [request['method'] for request in stub.requests] == ['POST', 'POST']
+    assert stub.requests[0]['body']['embeds'][0]['title'] == 'Closure Update'
+    assert pool.message_ids == {event['ID']: stub.requests[0]['message_id']}
+    assert stub.requests[1]['body']['content'] == f"Closure Update: {event['RoadwayName']} ({event['DirectionOfTravel']})"
+
 # Error Handling Tests
 def test_check_which_polygon_point_invalid_input():
     from shapely.geometry import Point
@@ -221,7 +1191,7 @@ def test_check_which_polygon_point_invalid_input():
     assert check_which_polygon_point(point) == 'Other'
 
 @mock_aws
-@patch('scrape.requests.get')
+@patch('closurebot.runtime.http_session.get')
 def test_check_and_post_events_api_error(mock_get, mock_config):
     # Set up mock DynamoDB table
     dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
@@ -232,8 +1202,8 @@ def test_check_and_post_events_api_error(mock_get, mock_config):
         BillingMode='PAY_PER_REQUEST'
     )
     
-    with patch('scrape.table', table), \
-         patch('scrape.config', mock_config):
+    with patch('closurebot.store.table', table), \
+         patch.object(runtime.config, 'settings', mock_config):
         mock_get.return_value.ok = False
         with pytest.raises(Exception, match='Issue connecting to NB511 API'):
             check_and_post_events()
\ No newline at end of file